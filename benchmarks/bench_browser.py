@@ -0,0 +1,146 @@
+"""Page ready time and memory of each Chrome profile, against the fake site.
+
+    python -m benchmarks.bench_browser [--profiles lean default] [--pages 5]
+                                       [--url https://... ...]
+                                       [--output results.json]
+
+Each profile starts its own Chrome, logs in to `fake_server` and loads the
+class schedule `--pages` times, timing each load until the schedule is ready
+(`waits.wait_for_schedule`). Any `--url` is loaded too, timed until the DOM is
+ready, which is the way to see the effect of blocking fonts and analytics on a
+real page. Afterwards the resident memory of chromedriver and every Chrome
+process under it is summed, read from /proc so Linux only.
+
+Needs Chrome and chromedriver, found the same way `webpage.get_driver` finds
+them.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import date
+from typing import Any, Dict, List
+
+from benchmarks.common import quiet_logging
+from clubready_booker import __version__, fake_server, waits, webpage
+
+
+def descendants(pid: int) -> List[int]:
+    """pid and the pids of all its descendant processes"""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # the command name can have spaces, ppid is after its ")"
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    pids = [pid]
+    for parent in pids:
+        pids.extend(children.get(parent, []))
+    return pids
+
+
+def rss_bytes(pids: List[int]) -> int:
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+
+def dom_ready(driver) -> bool:
+    return driver.execute_script("return document.readyState") != "loading"
+
+
+def measure(
+        profile: str,
+        server: fake_server.FakeServer,
+        n_pages: int,
+        urls: List[str]
+) -> Dict[str, Any]:
+    start = time.perf_counter()
+    driver = webpage.get_driver(server.login_url, profile=profile)
+    startup = time.perf_counter() - start
+    try:
+        webpage.login(driver, fake_server.USERNAME, fake_server.PASSWORD)
+        schedule_url = webpage.week_url(
+            fake_server.week_start(date.today()), server.base_url
+        )
+        page_times = []
+        for _ in range(n_pages):
+            start = time.perf_counter()
+            driver.get(schedule_url)
+            waits.wait_for_schedule(driver)
+            page_times.append(time.perf_counter() - start)
+        url_times = {}
+        for url in urls:
+            start = time.perf_counter()
+            driver.get(url)
+            waits.wait_until(driver, dom_ready, waits.PAGE, url)
+            url_times[url] = time.perf_counter() - start
+        rss = rss_bytes(descendants(driver.service.process.pid))
+    finally:
+        driver.quit()
+    return {
+        'profile': profile,
+        'startup_seconds': startup,
+        'page_ready_median': statistics.median(page_times),
+        'page_ready_max': max(page_times),
+        'url_seconds': url_times,
+        'rss_bytes': rss
+    }
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profiles", nargs="+", default=list(webpage.PROFILES))
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--url", nargs="*", default=[], dest="urls")
+    parser.add_argument("--output", help="write results JSON here")
+    args = parser.parse_args(argv)
+    quiet_logging()
+
+    results = []
+    with fake_server.serve() as server:
+        print(
+            f"{'profile':<10} {'startup s':>10} {'page ms p50':>12} "
+            f"{'page ms max':>12} {'RSS MB':>8}"
+        )
+        for profile in args.profiles:
+            result = measure(profile, server, args.pages, args.urls)
+            results.append(result)
+            print(
+                f"{profile:<10} {result['startup_seconds']:>10.2f} "
+                f"{result['page_ready_median'] * 1000:>12.1f} "
+                f"{result['page_ready_max'] * 1000:>12.1f} "
+                f"{result['rss_bytes'] / 2 ** 20:>8.0f}"
+            )
+            for url, seconds in result['url_seconds'].items():
+                print(f"  {url}: {seconds * 1000:.0f}ms")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                'version': __version__,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'timestamp': time.time(),
+                'results': results
+            }, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,155 @@
+"""Import time of each clubready_booker module, from `python -X importtime`.
+
+    python -m benchmarks.bench_imports [--repeats 5] [--output results.json]
+                                       [--compare baseline.json]
+                                       [--threshold 1.25]
+
+Every module is imported in a fresh interpreter. Its import time is the best
+of `--repeats` runs, and the heavy third party packages that it pulled in are
+listed: selenium, bs4, requests, the google client libraries and cryptography
+should only be imported by the code that uses them. With `--compare`, any
+module slower to import than the baseline by more than `--threshold` times, or
+that imports a heavy package it didn't before, is reported and the exit code
+is 1.
+"""
+import argparse
+import json
+import platform
+import re
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+from clubready_booker import __version__
+
+MODULES = [
+    "clubready_booker",
+    "clubready_booker.util",
+    "clubready_booker.metrics",
+    "clubready_booker.snapshots",
+    "clubready_booker.waits",
+    "clubready_booker.matching",
+    "clubready_booker.http_session",
+    "clubready_booker.session_store",
+    "clubready_booker.fast_parse",
+    "clubready_booker.cal_sync",
+    "clubready_booker.cal",
+    "clubready_booker.webpage",
+    "clubready_booker.table_cache",
+    "clubready_booker.booker",
+    "clubready_booker.runner",
+    "clubready_booker.scheduler",
+    "clubready_booker.watcher",
+]
+HEAVY = [
+    "selenium.webdriver.remote.webdriver",
+    "bs4",
+    "requests",
+    "googleapiclient.discovery",
+    "google_auth_oauthlib.flow",
+    "google.oauth2.credentials",
+    "cryptography.fernet",
+]
+IMPORT_TIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def import_times(statement: str) -> List[Tuple[int, str, int]]:
+    """(depth, module, cumulative microseconds) of every import in a fresh
+    interpreter running `statement`"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True, text=True, check=True
+    )
+    times = []
+    for line in proc.stderr.splitlines():
+        if match := IMPORT_TIME.match(line):
+            depth = len(match.group(3)) // 2
+            times.append((depth, match.group(4), int(match.group(2))))
+    return times
+
+
+def measure(module: str, startup: set, repeats: int) -> Dict[str, Any]:
+    best = None
+    imported = set()
+    for _ in range(repeats):
+        times = import_times(f"import {module}")
+        # top level imports, minus what the interpreter imports on startup
+        total = sum(
+            cumulative for depth, name, cumulative in times
+            if depth == 0 and name not in startup
+        )
+        best = total if best is None else min(best, total)
+        imported = {name for _, name, _ in times}
+    return {
+        'name': module,
+        'seconds': best / 1e6,
+        'heavy': [name for name in HEAVY if name in imported]
+    }
+
+
+def compare(
+        results: List[Dict[str, Any]],
+        baseline_path: str,
+        threshold: float
+) -> bool:
+    """Print modules that got slower or heavier, True if there are any"""
+    with open(baseline_path) as f:
+        baseline = {r['name']: r for r in json.load(f)['results']}
+    regressed = False
+    for result in results:
+        base = baseline.get(result['name'])
+        if base is None:
+            continue
+        ratio = result['seconds'] / base['seconds'] if base['seconds'] else 1
+        if ratio > threshold:
+            regressed = True
+            print(
+                f"REGRESSION {result['name']}: {base['seconds']:.4f}s -> "
+                f"{result['seconds']:.4f}s ({ratio:.2f}x)"
+            )
+        if new_heavy := set(result['heavy']) - set(base['heavy']):
+            regressed = True
+            print(
+                f"REGRESSION {result['name']} now imports "
+                f"{', '.join(sorted(new_heavy))}"
+            )
+    return regressed
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--compare", help="baseline results JSON")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    startup = {name for depth, name, _ in import_times("pass") if depth == 0}
+    results = []
+    print(f"{'module':<32} {'import ms':>10}  heavy imports", file=sys.stderr)
+    for module in MODULES:
+        result = measure(module, startup, args.repeats)
+        results.append(result)
+        print(
+            f"{module:<32} {result['seconds'] * 1000:>10.1f}  "
+            f"{', '.join(result['heavy'])}",
+            file=sys.stderr
+        )
+    report = {
+        'version': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'results': results
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        return int(compare(results, args.compare, args.threshold))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,182 @@
+"""End to end load test of many accounts booking against the fake site.
+
+    python -m benchmarks.bench_load [--accounts 20] [--concurrency 10]
+                                    [--latency 0.05] [--jitter 0.02]
+                                    [--class-size 5] [--bookings 3]
+                                    [--backend http] [--output results.json]
+
+Serves `fake_server` with `--accounts` members and a simulated network
+`--latency`, then runs every account through the whole booking flow, at most
+`--concurrency` at once: open a driver, log in, scrape the class table and
+book the same `--bookings` upcoming classes. With a small `--class-size` the
+accounts compete for the spots, so later ones are wait listed like on a busy
+morning at the club.
+
+Reports the wall time, accounts a second, and the count, p50, p99 and max of
+each phase in ms, plus how many bookings ended in each status. `--backend
+selenium` needs Chrome and chromedriver.
+"""
+import argparse
+import json
+import math
+import platform
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Any, Dict, List
+
+from benchmarks.common import TIMEZONE, quiet_logging
+from clubready_booker import __version__, fake_server, webpage
+from clubready_booker.records import ClassRecord
+
+PHASES = ("startup", "login", "schedule", "booking", "account")
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest rank percentile"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def targets(
+        class_table: List[ClassRecord],
+        n_bookings: int
+) -> List[ClassRecord]:
+    """The first classes that haven't started, the same for every account"""
+    upcoming = [
+        class_record for class_record in class_table
+        if class_record.booking_id and not class_record.started
+    ]
+    upcoming.sort(key=lambda class_record: class_record.start_time)
+    return upcoming[:n_bookings]
+
+
+def run_account(
+        server: fake_server.FakeServer,
+        username: str,
+        args: argparse.Namespace
+) -> Dict[str, Any]:
+    """Time one account through the booking flow"""
+    timings: Dict[str, List[float]] = {phase: [] for phase in PHASES}
+    account_start = time.perf_counter()
+    driver = webpage.get_driver(
+        server.login_url, args.backend, server.base_url
+    )
+    timings['startup'].append(time.perf_counter() - account_start)
+    try:
+        start = time.perf_counter()
+        webpage.login(driver, username, fake_server.PASSWORD)
+        timings['login'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        class_table = webpage.build_class_table(
+            driver, TIMEZONE, args.bookable_range, parser=args.parser
+        )
+        timings['schedule'].append(time.perf_counter() - start)
+
+        results = webpage.book_classes(
+            driver, targets(class_table, args.bookings)
+        )
+        timings['booking'].extend(result['seconds'] for result in results)
+    finally:
+        driver.quit()
+    timings['account'].append(time.perf_counter() - account_start)
+    return {
+        'timings': timings,
+        'statuses': [result['status'] for result in results]
+    }
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--accounts", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--classes-per-day", type=int, default=6)
+    parser.add_argument("--class-size", type=int, default=5)
+    parser.add_argument("--bookings", type=int, default=3,
+                        help="classes each account books")
+    parser.add_argument("--backend", choices=webpage.BACKENDS, default="http")
+    parser.add_argument("--bookable-range", type=int, default=7)
+    parser.add_argument("--parser", choices=("fast", "bs4"), default="fast")
+    parser.add_argument("--output", help="write results JSON here")
+    args = parser.parse_args(argv)
+    quiet_logging()
+
+    accounts = fake_server.member_accounts(args.accounts)
+    site = fake_server.FakeClubReady(
+        fake_server.generate_schedule(
+            date.today(), weeks=2, classes_per_day=args.classes_per_day,
+            class_size=args.class_size
+        ),
+        accounts, args.latency, args.jitter
+    )
+    with fake_server.serve(site) as server:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            futures = [
+                executor.submit(run_account, server, username, args)
+                for username in accounts
+            ]
+        wall = time.perf_counter() - start
+
+    timings: Dict[str, List[float]] = {phase: [] for phase in PHASES}
+    statuses: Counter = Counter()
+    errors = []
+    for future in futures:
+        try:
+            account = future.result()
+        except Exception as exc:
+            errors.append(repr(exc))
+            continue
+        for phase, seconds in account['timings'].items():
+            timings[phase].extend(seconds)
+        statuses.update(account['statuses'])
+
+    phases = {}
+    print(f"{'phase':<10} {'n':>6} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for phase in PHASES:
+        if not timings[phase]:
+            continue
+        phases[phase] = {
+            'n': len(timings[phase]),
+            'p50': percentile(timings[phase], 0.5),
+            'p99': percentile(timings[phase], 0.99),
+            'max': max(timings[phase])
+        }
+        print(
+            f"{phase:<10} {phases[phase]['n']:>6} "
+            f"{phases[phase]['p50'] * 1000:>9.1f} "
+            f"{phases[phase]['p99'] * 1000:>9.1f} "
+            f"{phases[phase]['max'] * 1000:>9.1f}"
+        )
+    print(
+        f"{args.accounts} accounts in {wall:.2f}s "
+        f"({args.accounts / wall:.1f}/s), bookings: {dict(statuses)}"
+    )
+    for error in errors:
+        print(f"account failed: {error}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                'version': __version__,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'timestamp': time.time(),
+                'args': vars(args),
+                'wall_seconds': wall,
+                'accounts_per_second': args.accounts / wall,
+                'phases': phases,
+                'statuses': dict(statuses),
+                'errors': errors
+            }, f, indent=2)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
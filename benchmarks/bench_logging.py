@@ -0,0 +1,123 @@
+"""Cost of logging to the code doing the logging, synchronous against queued.
+
+    python -m benchmarks.bench_logging [--scale 10] [--calls 5000]
+                                       [--output results.json]
+
+For each of `setup_logging`'s synchronous and queued handlers, at INFO and at
+DEBUG, times parsing a synthetic schedule of `--scale` normal weeks (per
+parsed class, with the fast and bs4 parsers) and `--calls` log calls (per
+call), as seen by the calling thread. Logs go to a temporary file, and the
+console to /dev/null, so the terminal's speed doesn't count.
+
+Also times a disabled debug message built eagerly with an f-string against
+one formatted lazily, with a summary set the size of a club's class names.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from benchmarks.common import TIMEZONE, best_of, synthetic_page
+from clubready_booker import __version__, setup_logging, stop_logging, webpage
+
+LEVELS = {'info': logging.INFO, 'debug': logging.DEBUG}
+
+logger = logging.getLogger("clubready_booker.bench")
+
+
+def n_classes(src: str, parser: str) -> int:
+    """Parse a schedule page, returning the number of classes"""
+    _, columns = webpage.get_column_parser(parser)(src, TIMEZONE)
+    return sum(len(column['classes']) for column in columns.values())
+
+
+def time_calls(n_calls: int) -> float:
+    """Seconds per INFO call, waiting for nothing to be written"""
+    start = time.perf_counter()
+    for idx in range(n_calls):
+        logger.info("Booked class %d of %d", idx, n_calls)
+    return (time.perf_counter() - start) / n_calls
+
+
+def time_disabled_debug(summary_set: set, n_calls: int) -> Dict[str, float]:
+    logger.setLevel(logging.INFO)
+    start = time.perf_counter()
+    for _ in range(n_calls):
+        logger.debug(f"Using summary set: {summary_set}")
+    eager = (time.perf_counter() - start) / n_calls
+    start = time.perf_counter()
+    for _ in range(n_calls):
+        logger.debug("Using summary set: %s", summary_set)
+    lazy = (time.perf_counter() - start) / n_calls
+    logger.setLevel(logging.NOTSET)
+    return {'eager': eager, 'lazy': lazy}
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=int, default=10)
+    parser.add_argument("--calls", type=int, default=5000)
+    parser.add_argument("--output", help="write results JSON here")
+    args = parser.parse_args(argv)
+
+    src = synthetic_page(args.scale)
+    results: List[Dict[str, Any]] = []
+    print(
+        f"{'handlers':<8} {'level':<6} {'fast us/class':>14} "
+        f"{'bs4 us/class':>13} {'us/call':>8}"
+    )
+    with tempfile.TemporaryDirectory() as tmp, \
+            open(os.devnull, "w") as devnull:
+        for queued in (False, True):
+            for level_name, level in LEVELS.items():
+                setup_logging(
+                    level, os.path.join(tmp, "bench.log"), None, devnull,
+                    queued
+                )
+                result = {
+                    'handlers': "queued" if queued else "sync",
+                    'level': level_name
+                }
+                for name in ("fast", "bs4"):
+                    seconds, n_parsed = best_of(n_classes, src, name)
+                    result[f'{name}_us_per_class'] = seconds / n_parsed * 1e6
+                result['us_per_call'] = time_calls(args.calls) * 1e6
+                stop_logging()
+                results.append(result)
+                print(
+                    f"{result['handlers']:<8} {level_name:<6} "
+                    f"{result['fast_us_per_class']:>14.1f} "
+                    f"{result['bs4_us_per_class']:>13.1f} "
+                    f"{result['us_per_call']:>8.2f}"
+                )
+
+    _, class_table = webpage.parse_class_table(src, TIMEZONE)
+    summary_set = {class_record.class_name for class_record in class_table}
+    disabled = time_disabled_debug(summary_set, args.calls)
+    print(
+        f"disabled debug with {len(summary_set)} summaries: "
+        f"f-string {disabled['eager'] * 1e6:.2f}us, "
+        f"lazy {disabled['lazy'] * 1e6:.2f}us"
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                'version': __version__,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'timestamp': time.time(),
+                'scale': args.scale,
+                'results': results,
+                'disabled_debug_seconds': disabled
+            }, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,46 @@
+"""Compare the bs4 and fast (lxml) class schedule parsers.
+
+    python -m benchmarks.bench_parser [recorded_classes.asp.html ...]
+
+With no arguments, synthetic schedules of increasing size are generated with
+`fake_server`. Every page is parsed by both parsers, and the benchmark fails if
+their output differs.
+"""
+import sys
+from pathlib import Path
+from typing import List, Tuple
+
+from benchmarks.common import TIMEZONE, best_of, quiet_logging, synthetic_page
+from clubready_booker import fast_parse, webpage
+
+SCALES = [1, 10, 100]
+
+
+def synthetic_pages() -> List[Tuple[str, str]]:
+    return [(f"synthetic {scale}x week", synthetic_page(scale)) for scale in SCALES]
+
+
+def main(paths: List[str]) -> int:
+    quiet_logging()
+    if paths:
+        pages = [(path, Path(path).read_text()) for path in paths]
+    else:
+        pages = synthetic_pages()
+    failed = False
+    print(f"{'page':<32} {'classes':>8} {'bs4 s':>9} {'fast s':>9} {'speedup':>8}")
+    for name, src in pages:
+        slow_time, slow = best_of(webpage.parse_class_columns, src, TIMEZONE)
+        fast_time, fast = best_of(fast_parse.parse_class_columns, src, TIMEZONE)
+        identical = repr(slow) == repr(fast)
+        failed = failed or not identical
+        n_classes = sum(len(col['classes']) for col in slow[1].values())
+        print(
+            f"{name[-32:]:<32} {n_classes:>8} {slow_time:>9.4f} "
+            f"{fast_time:>9.4f} {slow_time / fast_time:>7.1f}x"
+            f"{'' if identical else '  OUTPUT DIFFERS'}"
+        )
+    return int(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
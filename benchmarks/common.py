@@ -0,0 +1,92 @@
+"""Synthetic inputs and timing helpers shared by the benchmarks"""
+import logging
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Tuple
+
+from clubready_booker import fake_server
+from clubready_booker.http_session import ClubReadySession
+
+TIMEZONE = "America/New_York"
+# classes per day in a normal week at the club
+NORMAL_CLASSES_PER_DAY = 6
+
+
+def quiet_logging() -> None:
+    """Keep INFO logs from the code under test out of the timings"""
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def synthetic_week(scale: int = 1) -> Tuple[date, List[fake_server.FakeClass]]:
+    """A week with `scale` times the classes of a normal week"""
+    first_day = fake_server.week_start(date.today())
+    schedule = fake_server.generate_schedule(
+        first_day, classes_per_day=NORMAL_CLASSES_PER_DAY * scale
+    )
+    return first_day, schedule
+
+
+def synthetic_page(scale: int = 1) -> str:
+    return fake_server.render_schedule(*synthetic_week(scale))
+
+
+def synthetic_events(
+        schedule: List[fake_server.FakeClass],
+        timezone: str = TIMEZONE,
+        every: int = 3
+) -> List[Dict[str, Any]]:
+    """Calendar events for every `every`th class, in Google Calendar's shape"""
+    import pytz
+
+    tz = pytz.timezone(timezone)
+    events = []
+    for idx, fake_class in enumerate(schedule[::every]):
+        start = tz.localize(datetime(
+            fake_class.day.year, fake_class.day.month, fake_class.day.day,
+            fake_class.hour, fake_class.minute
+        ))
+        end = start + timedelta(minutes=fake_class.duration_mins)
+        events.append({
+            'id': f"event{idx}",
+            'status': 'confirmed',
+            'summary': fake_class.class_name,
+            'start': {'dateTime': start.isoformat()},
+            'end': {'dateTime': end.isoformat()}
+        })
+    return events
+
+
+class StubSession(ClubReadySession):
+    """Session that serves canned pages instead of going to the network"""
+
+    def __init__(self, page_source: str):
+        super().__init__("http://stub/login", "http://stub/clients")
+        self.canned = page_source
+
+    def _request(self, method: str, url: str, **kwargs):
+        self.current_url = url
+        self.page_source = self.canned
+
+    def fetch(self, url: str, **kwargs) -> str:
+        return self.canned
+
+
+def best_of(
+        func: Callable,
+        *args,
+        repeats: int = 3,
+        setup: Callable[[], Any] = None
+) -> Tuple[float, Any]:
+    """Fastest wall time of `repeats` calls and the result of the last call
+
+    If `setup` is given, its return value is passed as the only argument
+    instead of `args`, and the time it takes is not counted.
+    """
+    timings = []
+    result = None
+    for _ in range(repeats):
+        call_args = (setup(),) if setup is not None else args
+        start = time.perf_counter()
+        result = func(*call_args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
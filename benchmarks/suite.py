@@ -0,0 +1,208 @@
+"""Offline micro-benchmarks for the parse, match and serialize hot paths.
+
+    python -m benchmarks.suite [--scales 1 10 100 1000] [--output results.json]
+                               [--compare baseline.json] [--threshold 1.25]
+
+Every benchmark runs against a synthetic schedule of `scale` normal weeks worth
+of classes. Results are written as JSON so runs from different versions can be
+compared; with `--compare`, any benchmark slower than the baseline by more
+than `--threshold` times is reported and the exit code is 1.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from copy import deepcopy
+from datetime import timedelta
+from typing import Any, Dict, List
+
+import lxml.html
+from bs4 import BeautifulSoup
+from bs4.element import Tag
+
+from benchmarks.common import (
+    TIMEZONE, StubSession, best_of, quiet_logging, synthetic_events,
+    synthetic_week
+)
+from clubready_booker import __version__, booker, cal, fake_server, webpage
+from clubready_booker.fast_parse import ClassParser
+
+DEFAULT_SCALES = [1, 10, 100, 1000]
+
+
+class FakeEventsRequest:
+
+    def __init__(self, events: List[dict]):
+        self.events = events
+
+    def execute(self) -> Dict[str, Any]:
+        return {'items': deepcopy(self.events)}
+
+
+class FakeCalendarService:
+    """Just enough of the Google Calendar `Resource` for get_next_events"""
+
+    def __init__(self, events: List[dict]):
+        self._events = events
+
+    def events(self) -> "FakeCalendarService":
+        return self
+
+    def list(self, **kwargs) -> FakeEventsRequest:
+        return FakeEventsRequest(self._events)
+
+
+def class_elems(src: str, parse) -> List[tuple]:
+    """(class_elem, column_date, class_idx) for every class on the page"""
+    date_span, _ = webpage.parse_class_table(src, TIMEZONE)
+    elems = []
+    if parse is BeautifulSoup:
+        schedule = BeautifulSoup(src, features="lxml").find(id="scheduleRow")
+        cols = [child for child in schedule.children if isinstance(child, Tag)]
+        divs = [
+            col.find("td").find_all("div", recursive=False) for col in cols
+        ]
+    else:
+        schedule = lxml.html.fromstring(src).xpath("//*[@id='scheduleRow']")[0]
+        divs = [
+            [d for d in next(col.iterdescendants("td")) if d.tag == "div"]
+            for col in schedule
+        ]
+    for day_idx, col_divs in enumerate(divs):
+        column_date = date_span[0] + timedelta(days=day_idx)
+        elems.extend(
+            (elem, column_date, idx) for idx, elem in enumerate(col_divs)
+        )
+    return elems
+
+
+def run_scale(scale: int) -> List[Dict[str, Any]]:
+    repeats = 3 if scale < 100 else 1
+    first_day, schedule = synthetic_week(scale)
+    src = fake_server.render_schedule(first_day, schedule)
+    events = synthetic_events(schedule)
+    results = []
+
+    def record(name: str, n_items: int, seconds: float):
+        results.append({
+            'name': name,
+            'scale': scale,
+            'items': n_items,
+            'seconds': seconds,
+            'us_per_item': seconds / n_items * 1e6 if n_items else None
+        })
+        print(
+            f"{name:<32} {scale:>5}x {n_items:>8} {seconds:>10.4f}s "
+            f"{results[-1]['us_per_item'] or 0:>10.1f}us/item",
+            file=sys.stderr
+        )
+
+    bs4_elems = class_elems(src, BeautifulSoup)
+    seconds, _ = best_of(
+        lambda: [webpage.parse_class_elem(e, d, i, TIMEZONE)
+                 for e, d, i in bs4_elems],
+        repeats=repeats
+    )
+    record("parse_class_elem[bs4]", len(bs4_elems), seconds)
+
+    lxml_elems = class_elems(src, lxml.html)
+    # one parser per page, as parse_class_columns makes
+    class_parser = ClassParser(TIMEZONE)
+    seconds, _ = best_of(
+        lambda: [class_parser.parse(e, d, i) for e, d, i in lxml_elems],
+        repeats=repeats
+    )
+    record("parse_class_elem[fast]", len(lxml_elems), seconds)
+
+    for parser in webpage.PARSERS:
+        seconds, class_table = best_of(
+            lambda: webpage.build_class_table(
+                StubSession(src), TIMEZONE, parser=parser
+            ),
+            repeats=repeats
+        )
+        record(f"build_class_table[{parser}]", len(class_table), seconds)
+
+    seconds, serialized = best_of(
+        webpage.serialize_class_table, class_table, repeats=repeats
+    )
+    record("serialize_class_table", len(class_table), seconds)
+    seconds, _ = best_of(
+        webpage.load_serialized_class_table, serialized, repeats=repeats
+    )
+    record("load_serialized_class_table", len(class_table), seconds)
+
+    class_names = {row.class_name for row in class_table}
+    service = FakeCalendarService(events)
+    seconds, valid_events = best_of(
+        cal.get_next_events, service, class_names, 2, len(events),
+        repeats=repeats
+    )
+    record("get_next_events", len(events), seconds)
+
+    seconds, _ = best_of(
+        booker.match_events, events, class_table, repeats=repeats
+    )
+    record("match_events", len(events) + len(class_table), seconds)
+    return results
+
+
+def compare(
+        results: List[Dict[str, Any]],
+        baseline_path: str,
+        threshold: float
+) -> bool:
+    """Print benchmarks slower than the baseline, True if there are any"""
+    with open(baseline_path) as f:
+        baseline = {
+            (r['name'], r['scale']): r for r in json.load(f)['results']
+        }
+    regressed = False
+    for result in results:
+        base = baseline.get((result['name'], result['scale']))
+        if base is None or not base['seconds']:
+            continue
+        ratio = result['seconds'] / base['seconds']
+        if ratio > threshold:
+            regressed = True
+            print(
+                f"REGRESSION {result['name']} at {result['scale']}x: "
+                f"{base['seconds']:.4f}s -> {result['seconds']:.4f}s "
+                f"({ratio:.2f}x)"
+            )
+    return regressed
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES)
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--compare", help="baseline results JSON")
+    parser.add_argument("--threshold", type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    quiet_logging()
+    results = []
+    for scale in args.scales:
+        results.extend(run_scale(scale))
+    report = {
+        'version': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'results': results
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        return int(compare(results, args.compare, args.threshold))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
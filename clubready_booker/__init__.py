@@ -1,27 +1,126 @@
-import logging.handlers
+import json
+import logging
 import os
+from typing import Optional, TextIO
 
 __version__ = "0.0.1"
 
 LOGFILE = "clubready_booker.log"
 LOGLEVEL = os.environ.get("LOGLEVEL", logging.INFO)
-
-file_handler = logging.handlers.RotatingFileHandler(
-    LOGFILE, maxBytes=2000000, backupCount=3
-)
-
-
-handlers = [file_handler, logging.StreamHandler()]
+# also log JSON lines to this file, off if unset
+JSON_LOGFILE = os.environ.get("LOGJSON")
 
 msg_format = (
     "%(asctime)s: [%(filename)s:%(lineno)s - %(funcName)s ] "
     "%(levelname)s  %(message)s"
 )
 
-logging.basicConfig(
-    level=LOGLEVEL,
-    format=msg_format,
-    handlers=handlers
-)
+_listener = None
+_stop_registered = False
+
+
+class QueueingHandler(logging.Handler):
+    """Puts records on a queue for a `QueueListener` in the same process
+
+    Unlike `logging.handlers.QueueHandler`, records keep their `exc_info`, so
+    the handlers behind the queue format the traceback themselves. Only the
+    message is merged with its args, so later changes to the args don't show.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__()
+        self.queue = log_queue
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+            self.queue.put_nowait(record)
+        except Exception:
+            self.handleError(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object a line, for loading logs into other tools"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'file': record.filename,
+            'line': record.lineno,
+            'func': record.funcName,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def setup_logging(
+        level=LOGLEVEL,
+        logfile: str = LOGFILE,
+        json_logfile: Optional[str] = JSON_LOGFILE,
+        stream: Optional[TextIO] = None,
+        queued: bool = True
+) -> None:
+    """Log to the console and a rotating log file, and JSON lines to
+    `json_logfile` if given
+
+    Importing the package configures nothing, so entry points call this before
+    doing anything else. Unless not `queued`, the logging thread only puts
+    records on a queue, and a background thread formats and writes them, so
+    file I/O and rotation stay off the hot path. Calling it again replaces
+    the handlers.
+    """
+    global _listener, _stop_registered
+    import atexit
+    import logging.handlers
+    import queue
+
+    stop_logging()
+    formatter = logging.Formatter(msg_format)
+    handlers = [
+        logging.handlers.RotatingFileHandler(
+            logfile, maxBytes=2000000, backupCount=3
+        ),
+        logging.StreamHandler(stream)
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    if json_logfile:
+        json_handler = logging.handlers.RotatingFileHandler(
+            json_logfile, maxBytes=2000000, backupCount=3
+        )
+        json_handler.setFormatter(JsonFormatter())
+        handlers.append(json_handler)
+
+    if queued:
+        log_queue = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(
+            log_queue, *handlers, respect_handler_level=True
+        )
+        _listener.start()
+        if not _stop_registered:
+            atexit.register(stop_logging)
+            _stop_registered = True
+        handlers = [QueueingHandler(log_queue)]
+
+    logging.basicConfig(level=level, handlers=handlers)
+
+    logging.info(f"Running clubready_booker on version {__version__}")
+
 
-logging.info(f"Running clubready_booker on version {__version__}")
+def stop_logging() -> None:
+    """Write out any queued records and remove the handlers `setup_logging`
+    added"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
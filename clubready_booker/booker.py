@@ -1,58 +1,512 @@
-"""Bring it all together into a functioning app"""
-from clubready_booker import cal, webpage
-from operator import itemgetter
+"""Bring it all together into a functioning app
+
+A run has two stages. Planning matches calendar events to the class table, from
+the cache or scraped with `plan_backend`, which needs no browser by default,
+into a `BookingPlan`. Committing books the plan with `backend`, opening a
+browser only if there is anything to book. A plan can be saved and booked by
+a later run:
+
+    python clubready_booker/booker.py [--plan-only] [--plan booking_plan.bin]
+"""
+from clubready_booker import cal, cal_sync, setup_logging, webpage
+from operator import attrgetter
+import argparse
+import contextlib
+import datetime
+import itertools
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import (
+    Any, Callable, Dict, List, Optional, Set, TYPE_CHECKING, TypeVar
+)
 
-import ft
+from clubready_booker import (
+    matching, metrics, records, snapshots, table_cache, util, waits
+)
+from clubready_booker.records import ClassRecord
 
-from clubready_booker import util
+if TYPE_CHECKING:
+    from selenium.webdriver.remote.webdriver import WebDriver
 
 
 logger = logging.getLogger(__name__)
 
+PLAN_FORMAT_VERSION = 1
+
+T = TypeVar('T')
+
+
+def match_events(
+        upcoming_events: List[dict],
+        class_table: List[ClassRecord],
+        tolerance: float = 0
+) -> List[ClassRecord]:
+    """Classes with the same name and start time as a calendar event
+
+    Args:
+        upcoming_events: Google Calendar events
+        class_table: classes from `webpage.build_class_table`
+        tolerance: seconds an event's and a class's start times can differ by
+    """
+    result = matching.match_events(
+        upcoming_events, class_table, datetime.timedelta(seconds=tolerance)
+    )
+    for event in result.unmatched_events:
+        logger.debug(
+            'No classes for event "%s" at %s', event.get("summary"),
+            event.get("start")
+        )
+    metrics.count("matches", len(result.matches))
+    return [matching_class for _, matching_class in result.matches]
+
+
+class LazyDriver:
+    """Opens and logs in a driver the first time one is actually needed
+
+    Call it for the driver.
+
+    Args:
+        config: from `util.get_config`
+        semaphore: if given, held from opening the driver until it is closed,
+            to cap how many browsers are open at once
+    """
+
+    def __init__(
+            self,
+            config: Dict[str, Any],
+            semaphore: Optional[threading.Semaphore] = None
+    ):
+        self.config = config
+        self.semaphore = semaphore
+        self.driver = None
+
+    def __call__(self) -> "WebDriver":
+        if self.driver is None:
+            if self.semaphore is not None:
+                self.semaphore.acquire()
+            try:
+                self.driver = self._open()
+            except Exception as exc:
+                if self.semaphore is not None:
+                    self.semaphore.release()
+                raise exc
+        return self.driver
+
+    def _open(self) -> "WebDriver":
+        driver = webpage.get_driver(
+            self.config['url'], self.config['backend'], self.config['base_url'],
+            self.config['browser_profile']
+        )
+        try:
+            if util.to_bool(self.config['reuse_session']):
+                webpage.login_with_saved_session(
+                    driver, self.config['username'], self.config['password'],
+                    self.config['url'], self.config['base_url']
+                )
+            else:
+                webpage.login(
+                    driver, self.config['username'], self.config['password']
+                )
+        except Exception as exc:
+            # login may already have closed it
+            with contextlib.suppress(Exception):
+                driver.quit()
+            raise exc
+        return driver
+
+    def close(self) -> None:
+        if self.driver is not None:
+            try:
+                self.driver.close()
+            finally:
+                self.driver = None
+                if self.semaphore is not None:
+                    self.semaphore.release()
+
+
+class BookingPool:
+    """Logged in drivers that book a list of classes between them
+
+    Each driver is a separate browser, or http session, with its own login, so
+    bookings don't queue behind one another's popups. The first driver may
+    reuse the saved session, the others always log in, since requests on one
+    ClubReady session are handled one at a time.
+
+    Args:
+        config: from `util.get_config`
+        size: number of drivers
+        first: driver to use as the first one, e.g. one already logged in.
+            It is left for the caller to close
+    """
+
+    def __init__(
+            self,
+            config: Dict[str, Any],
+            size: int,
+            first: Optional[LazyDriver] = None
+    ):
+        self.borrowed = first
+        self.drivers = [first or LazyDriver(config)]
+        fresh_login = {**config, 'reuse_session': False}
+        self.drivers.extend(LazyDriver(fresh_login) for _ in range(size - 1))
+        self.ready: List[LazyDriver] = []
+
+    def open(self) -> None:
+        """Open, log in and load the classes page on every driver at once
+
+        Drivers that fail to open are left out, as long as one opens.
+        """
+        def prepare(open_driver: LazyDriver) -> LazyDriver:
+            webpage.get_classes_page(open_driver())
+            return open_driver
+
+        with metrics.span("open_pool"):
+            with ThreadPoolExecutor(max_workers=len(self.drivers)) as executor:
+                futures = [
+                    executor.submit(prepare, open_driver)
+                    for open_driver in self.drivers
+                ]
+        self.ready = []
+        error = None
+        for future in futures:
+            try:
+                self.ready.append(future.result())
+            except Exception as exc:
+                logger.exception("Could not open a driver for booking")
+                error = exc
+        if not self.ready:
+            raise error
+        logger.info(f"{len(self.ready)} drivers ready to book")
+
+    def book(
+            self,
+            class_records: List[ClassRecord],
+            dry_run: bool = False
+    ) -> List[Dict[str, Any]]:
+        """Book the classes, scarcest first, spread over the drivers
+
+        Each driver takes the next class as soon as it is done with its last,
+        so the scarcest classes are attempted first, loading the class's
+        schedule week if it isn't on that week already. Returns the results of
+        `webpage.book_classes` in the order attempted, each also with the
+        `worker` that booked it.
+        """
+        if not self.ready:
+            self.open()
+        queue = webpage.by_scarcity(class_records)
+        next_idx = itertools.count()
+        results: List[Optional[Dict[str, Any]]] = [None] * len(queue)
+
+        def work(worker: int, driver: "WebDriver") -> None:
+            # count's next is atomic, so no class is taken twice
+            while (idx := next(next_idx)) < len(queue):
+                result = webpage.attempt_booking(
+                    driver, queue[idx], dry_run, load_week=True
+                )
+                result['worker'] = worker
+                results[idx] = result
+
+        workers = min(len(self.ready), len(queue))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in [
+                executor.submit(work, worker, self.ready[worker]())
+                for worker in range(workers)
+            ]:
+                future.result()
+        webpage.report_bookings(results)
+        return results
+
+    def close(self) -> None:
+        for open_driver in self.drivers:
+            if open_driver is self.borrowed:
+                continue
+            try:
+                open_driver.close()
+            except Exception:
+                logger.exception("Could not close a booking driver")
+        self.ready = []
+
+
+def planning_driver(
+        config: Dict[str, Any],
+        semaphore: Optional[threading.Semaphore] = None
+) -> LazyDriver:
+    """Driver to scrape the class schedule with, using `plan_backend`"""
+    backend = config['plan_backend'] or config['backend']
+    return LazyDriver({**config, 'backend': backend}, semaphore)
+
+
+def with_planning_driver(
+        config: Dict[str, Any],
+        scrape: Callable[[LazyDriver], T],
+        semaphore: Optional[threading.Semaphore] = None
+) -> T:
+    """Call `scrape` with a `planning_driver`, closing it afterwards
+
+    If it fails with `plan_backend`, it is tried once more with `backend`, so
+    a site the http backend can't handle can still be planned for.
+    """
+    open_driver = planning_driver(config, semaphore)
+    plan_backend = open_driver.config['backend']
+    try:
+        return scrape(open_driver)
+    except Exception:
+        if plan_backend == config['backend']:
+            raise
+        logger.exception(
+            f"Planning with the {plan_backend} backend failed, trying again "
+            f"with {config['backend']}"
+        )
+    finally:
+        open_driver.close()
+    fallback_driver = LazyDriver(config, semaphore)
+    try:
+        return scrape(fallback_driver)
+    finally:
+        fallback_driver.close()
+
+
+@dataclass
+class BookingPlan:
+    """Classes to book, worked out without booking anything
+
+    Args:
+        classes: matched classes to book
+        username: account the plan is for
+        club: login url of the club the classes are at
+        created_at: epoch seconds the plan was made
+    """
+    classes: List[ClassRecord] = field(default_factory=list)
+    username: Optional[str] = None
+    club: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+
+    def __len__(self) -> int:
+        return len(self.classes)
+
+    def pending(
+            self,
+            now: Optional[datetime.datetime] = None
+    ) -> List[ClassRecord]:
+        """Classes in the plan that haven't started"""
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        return [
+            class_record for class_record in self.classes
+            if class_record.start_time is None or class_record.start_time > now
+        ]
+
+    def dumps(self) -> bytes:
+        return records.pack({
+            'version': PLAN_FORMAT_VERSION,
+            'username': self.username,
+            'club': self.club,
+            'created_at': self.created_at,
+            'classes': records.dumps(self.classes)
+        })
+
+    @classmethod
+    def loads(cls, data: bytes) -> "BookingPlan":
+        contents = records.unpack(data)
+        if contents.get('version') != PLAN_FORMAT_VERSION:
+            raise ValueError(
+                f"Unknown booking plan format version {contents.get('version')}"
+            )
+        return cls(
+            records.loads(contents['classes']), contents['username'],
+            contents['club'], contents['created_at']
+        )
+
+    def save(self, path: Path) -> None:
+        util.atomic_write(path, self.dumps())
+
+    @classmethod
+    def load(cls, path: Path) -> "BookingPlan":
+        return cls.loads(path.read_bytes())
+
+
+def plan_bookings(config: Dict[str, Any]) -> BookingPlan:
+    """Match calendar events to classes, scraping with `plan_backend` only if
+    the class table cache is stale"""
+    with metrics.span("plan"):
+        matched = find_matches(config)
+    plan = BookingPlan(matched, config['username'], config['url'])
+    logger.info(f"Planned {len(plan)} bookings")
+    return plan
+
+
+def commit_plan(
+        config: Dict[str, Any],
+        plan: BookingPlan,
+        dry_run: bool = False
+) -> List[Dict[str, Any]]:
+    """Book a plan's classes that haven't started, opening a driver only if
+    there are any
+
+    Raises:
+        ValueError: if the plan was made for another account or club
+
+    Returns:
+        results of the bookings, see `webpage.book_classes`
+    """
+    if (plan.username, plan.club) != (config['username'], config['url']):
+        raise ValueError(
+            f"The plan is for {plan.username} at {plan.club}, not "
+            f"{config['username']} at {config['url']}"
+        )
+    pending = plan.pending()
+    if len(pending) < len(plan):
+        logger.info(
+            f"Skipping {len(plan) - len(pending)} planned classes that have "
+            f"started"
+        )
+    if not pending:
+        logger.info("Nothing to book")
+        return []
+    open_driver = LazyDriver(config)
+    try:
+        with metrics.span("commit"):
+            return book_matches(config, open_driver, pending, dry_run)
+    finally:
+        open_driver.close()
 
-def main(dry_run=False):
+
+def book_matches(
+        config: Dict[str, Any],
+        open_driver: LazyDriver,
+        matched: List[ClassRecord],
+        dry_run: bool = False
+) -> List[Dict[str, Any]]:
+    """Book matched classes, scarcest first, over `booking_workers` drivers
+
+    With one worker, or one class, they are booked one after another on
+    `open_driver`.
+    """
+    workers = min(int(config['booking_workers']), len(matched))
+    if workers <= 1:
+        return webpage.book_classes(
+            open_driver(), webpage.by_scarcity(matched), dry_run
+        )
+    pool = BookingPool(config, workers, open_driver)
+    try:
+        return pool.book(matched, dry_run)
+    finally:
+        pool.close()
+
+
+def find_matches(
+        config: Dict[str, Any],
+        open_driver: Optional[Callable[[], "WebDriver"]] = None,
+        lookahead: int = 0
+) -> List[ClassRecord]:
+    """Classes in the class table that match an upcoming calendar event
+
+    Args:
+        config: from `util.get_config`
+        open_driver: called for a logged in driver if the site must be
+            scraped, by default a `planning_driver`, see
+            `with_planning_driver`
+        lookahead: extra days past the bookable range to look for classes and
+            events in, for classes that can't be booked yet
+    """
+    bookable_range = int(config['bookable_range'])
+
+    def scrape(driver: Callable[[], "WebDriver"]) -> List[ClassRecord]:
+        return table_cache.get_class_table(
+            driver,
+            config['timezone'],
+            bookable_range + lookahead,
+            float(config['cache_ttl']),
+            parser=config['parser'],
+            club=config['url']
+        )
+
+    # only the scrape falls back to `backend`, calendar errors are raised as is
+    if open_driver is None:
+        class_table = with_planning_driver(config, scrape)
+    else:
+        class_table = scrape(open_driver)
+
+    # the calendar is fetched after scraping so that events for other things
+    # are dropped as they arrive, instead of all being held until matching
+    class_names = set(map(attrgetter('class_name'), class_table))
+    upcoming_events = get_calendar_events(
+        config, bookable_range, lookahead, class_names
+    )
+
+    return match_events(
+        upcoming_events, class_table, float(config['match_tolerance'])
+    )
+
+
+def get_calendar_events(
+        config: Dict[str, Any],
+        bookable_range: int,
+        lookahead: int = 0,
+        summary_set: Optional[Set[str]] = None
+) -> List[dict]:
+    """Upcoming calendar events for one of `summary_set`, for any class if
+    None"""
+    token_filename = config['calendar_token'] or cal.TOKEN_FILENAME
+    cal_service = cal.get_service(token_filename)
+    return cal.get_next_events(
+        cal_service,
+        summary_set,
+        bookable_range,
+        sync=util.to_bool(config['calendar_sync']),
+        horizon=(
+            datetime.timedelta(days=bookable_range + lookahead)
+            if lookahead else None
+        ),
+        store_path=cal_sync.store_path_for(config['calendar_token'])
+    )
+
+
+def main(
+        dry_run: bool = False,
+        plan_only: bool = False,
+        plan_path: Optional[Path] = None
+) -> None:
+    """Plan and book
+
+    Args:
+        dry_run: go through booking without confirming it
+        plan_only: only plan, saving the plan to `plan_path` if given
+        plan_path: with `plan_only`, where to save the plan, otherwise a saved
+            plan to book instead of planning
+    """
     config = util.get_config()
-    tbl_cache = util.get_config_location().joinpath(webpage.TABLE_CACHE_NAME)
-    driver = None
+    waits.configure(config['wait_budgets'])
     try:
-        if tbl_cache.exists():
-            logger.info(f"Loading class table from cache: {str(tbl_cache)}")
-            with tbl_cache.open('r') as f:
-                class_table = webpage.load_serialized_class_table(f.read())
-        else:
-            driver = webpage.get_driver(config['url'])
-            webpage.login(driver, config['username'], config['password'])
-            class_table = webpage.build_class_table(driver, config['timezone'])
-
-        class_names = set(map(itemgetter('class_name'), class_table))
-
-        cal_service = cal.get_service()
-        upcoming_events = cal.get_next_events(
-            cal_service, class_names, config['bookable_range']
-        )
-
-        by_class_name = ft.indexBy("class_name", class_table)
-
-        for event in upcoming_events:
-            event_summary = event['summary']
-            event_start = cal.get_event_start_datetime(event)
-            classes = by_class_name.get(event_summary, [])
-            if not classes:
-                logger.debug(f'No classes for event "{event_summary}"')
-            for matching_class in classes:
-                if event_start == matching_class['start_time']:
-                    if driver is None:
-                        logger.warning(f"No Driver at class booking time")
-                    else:
-                        webpage.book_class(driver, matching_class, dry_run)
+        with metrics.recording("booker", util.to_bool(config['metrics'])), \
+                snapshots.recording(util.to_bool(config['snapshots'])):
+            if plan_path is not None and not plan_only:
+                plan = BookingPlan.load(plan_path)
+                logger.info(
+                    f"Loaded a plan of {len(plan)} bookings from {plan_path}"
+                )
+            else:
+                plan = plan_bookings(config)
+            if plan_only:
+                if plan_path is not None:
+                    plan.save(plan_path)
+                return
+            commit_plan(config, plan, dry_run)
     except Exception as exc:
         logger.exception("Encountered an exception")
         raise exc
-    finally:
-        if driver is not None:
-            driver.close()
 
 
 if __name__ == "__main__":
-    main(dry_run=True)
+    parser = argparse.ArgumentParser(description="Book matched classes")
+    parser.add_argument("--plan-only", action="store_true",
+                        help="work out what to book without booking it")
+    parser.add_argument("--plan", type=Path, dest="plan_path",
+                        help="save the plan here with --plan-only, otherwise "
+                             "book this saved plan")
+    args = parser.parse_args()
+    setup_logging()
+    main(dry_run=True, plan_only=args.plan_only, plan_path=args.plan_path)
@@ -4,17 +4,23 @@ Cannot name it calendar.py or ese imports break
 """
 import datetime
 import logging
-from typing import Optional, Set, List
+import threading
+from typing import Iterable, Iterator, Optional, Set, List, TYPE_CHECKING
 import os
 from collections import Counter
+from pathlib import Path
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build, Resource
-from googleapiclient.errors import HttpError
+from clubready_booker import cal_sync, metrics, setup_logging
+from clubready_booker.matching import normalize_name
+from clubready_booker.util import (
+    atomic_write, get_config_location, default_config_vals
+)
 
-from clubready_booker.util import get_config_location, default_config_vals
+# the google client libraries take hundreds of ms to import, so they are only
+# imported once the calendar is actually used
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+    from googleapiclient.discovery import Resource
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
@@ -23,32 +29,148 @@ logger = logging.getLogger(__name__)
 
 CREDENTIALS_FILENAME = "calendar_credentials.json"
 TOKEN_FILENAME = "token.json"
+# a copy of the discovery document to build the service from, see
+# `get_discovery_document`
+DISCOVERY_FILENAME = "calendar_v3_discovery.json"
+CALENDAR_API = ('calendar', 'v3')
+# a token this close to expiring is refreshed in the background
+REFRESH_LEAD = datetime.timedelta(minutes=10)
 
+# token files being refreshed in the background
+_refreshing: Set[Path] = set()
+_refresh_lock = threading.Lock()
+
+
+def _save_token(creds: "Credentials", token_path: Path) -> None:
+    # another thread or run may be reading it, so replace it atomically
+    atomic_write(token_path, creds.to_json(), 0o600)
+
+
+def needs_refresh(
+        creds: "Credentials",
+        lead: datetime.timedelta = REFRESH_LEAD
+) -> bool:
+    """Whether a still valid token expires within `lead`"""
+    if creds.expiry is None or not creds.refresh_token:
+        return False
+    # google-auth keeps expiry as naive utc
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return creds.expiry - now < lead
+
+
+def refresh_token(token_path: Path) -> None:
+    """Refresh the saved token and save it, for the next service built"""
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+
+    try:
+        creds = Credentials.from_authorized_user_file(str(token_path), SCOPES)
+        creds.refresh(Request())
+        _save_token(creds, token_path)
+        logger.debug(f"Refreshed Google Calendar token {token_path.name}")
+    except Exception:
+        logger.exception(
+            f"Could not refresh Google Calendar token {token_path}"
+        )
+    finally:
+        with _refresh_lock:
+            _refreshing.discard(token_path)
+
+
+def refresh_token_in_background(
+        token_path: Path
+) -> Optional[threading.Thread]:
+    """Refresh the token in another thread, unless that is already happening
+
+    The service being built keeps using the current, still valid, token. The
+    thread is not a daemon, so a short run waits for the refresh at exit
+    rather than losing it.
+    """
+    with _refresh_lock:
+        if token_path in _refreshing:
+            return None
+        _refreshing.add(token_path)
+    thread = threading.Thread(
+        target=refresh_token, args=(token_path,), name="token-refresh"
+    )
+    thread.start()
+    return thread
+
+
+def get_discovery_document(config_dir: Optional[Path] = None) -> Optional[str]:
+    """The Calendar API discovery document, without going to the network
+
+    A copy saved as `DISCOVERY_FILENAME` in the config dir is used first, then
+    the one bundled with googleapiclient. None if neither is there.
+    """
+    if config_dir is None:
+        config_dir = get_config_location()
+    saved_path = config_dir.joinpath(DISCOVERY_FILENAME)
+    if saved_path.exists():
+        return saved_path.read_text()
+    try:
+        from googleapiclient.discovery_cache import get_static_doc
+    except ImportError:
+        # googleapiclient older than 2.0 has no bundled documents
+        return None
+    return get_static_doc(*CALENDAR_API)
+
+
+@metrics.timed("calendar_service")
+def get_service(
+        token_filename: str = TOKEN_FILENAME,
+        config_dir: Optional[Path] = None
+) -> "Resource":
+    """Authorized Google Calendar service
+
+    The service is built from a local discovery document (see
+    `get_discovery_document`) and a token close to expiring is refreshed in
+    the background, so building it doesn't wait on the network unless the
+    token has already expired or there is none.
+
+    Args:
+        token_filename: file in the config dir holding this account's OAuth
+            token, give each account its own when running several
+        config_dir: where the token, credentials and discovery document are,
+            defaults to `util.get_config_location`
+    """
+    from google.oauth2.credentials import Credentials
+    from googleapiclient.discovery import build, build_from_document
 
-def get_service() -> Resource:
     creds = None
     # The file token.json stores the user's access and refresh tokens, and is
     # created automatically when the authorization flow completes for the first
     # time.
     try:
-        conf_location = get_config_location()
-        token_path = conf_location.joinpath(TOKEN_FILENAME)
+        conf_location = config_dir
+        if conf_location is None:
+            conf_location = get_config_location()
+        token_path = conf_location.joinpath(token_filename)
         credentials_path = conf_location.joinpath(CREDENTIALS_FILENAME)
         if token_path.exists():
             creds = Credentials.from_authorized_user_file(str(token_path), SCOPES)
         # If there are no (valid) credentials available, let the user log in.
         if not creds or not creds.valid:
             if creds and creds.expired and creds.refresh_token:
+                from google.auth.transport.requests import Request
+
                 creds.refresh(Request())
             else:
+                from google_auth_oauthlib.flow import InstalledAppFlow
+
                 flow = InstalledAppFlow.from_client_secrets_file(
                     str(credentials_path), SCOPES)
                 creds = flow.run_local_server(port=0)
             # Save the credentials for the next run
-            with token_path.open("w") as token:
-                token.write(creds.to_json())
+            _save_token(creds, token_path)
+        elif needs_refresh(creds):
+            refresh_token_in_background(token_path)
 
-        service = build('calendar', 'v3', credentials=creds)
+        document = get_discovery_document(conf_location)
+        if document is not None:
+            service = build_from_document(document, credentials=creds)
+        else:
+            service = build(*CALENDAR_API, credentials=creds)
     except Exception as exc:
         logger.exception(
             "Encountered and error building the Google Calendar service"
@@ -62,63 +184,136 @@ def get_event_start_datetime(event: dict) -> datetime.datetime:
     return datetime.datetime.fromisoformat(event_start['dateTime'])
 
 
+def iter_events(
+        service: "Resource",
+        now: datetime.datetime,
+        until: datetime.datetime,
+        max_results: int = default_config_vals['max_results']
+) -> Iterator[dict]:
+    """Events not over by now that start before `until`, one page of
+    `max_results` at a time as they arrive
+
+    The window and the fields needed are sent to the API, so only events that
+    could be booked, and only the parts of them that are used, are downloaded.
+    """
+    for page in cal_sync.list_pages(
+            service, calendarId='primary', timeMin=now.isoformat(),
+            timeMax=until.isoformat(), singleEvents=True,
+            maxResults=max_results, orderBy="startTime",
+            fields=cal_sync.LIST_FIELDS
+    ):
+        items = page.get('items', [])
+        metrics.count("events_fetched", len(items))
+        yield from items
+
+
+def filter_events(
+        events: Iterable[dict],
+        now: datetime.datetime,
+        summary_set: Optional[Set[str]] = None,
+        horizon: Optional[datetime.timedelta] = None
+) -> List[dict]:
+    """Events that are confirmed, upcoming and for one of the summaries
+
+    Events starting more than `horizon` (default one day) from now are dropped.
+    `events` is only iterated once, so events can be filtered as they are
+    fetched.
+    """
+    # normalize class names
+    if summary_set is not None:
+        summary_set = {normalize_name(summary) for summary in summary_set}
+        logger.debug("Using summary set: %s", summary_set)
+    else:
+        logger.debug("No summary set provided, allowing all summaries.")
+
+    max_start_time = now + (horizon or datetime.timedelta(1))
+    valid_events = []
+    invalid_reasons = []
+    n_events = 0
+    for event in events:
+        n_events += 1
+        status = event.get('status', 'cancelled')
+        if status == 'cancelled':
+            invalid_reasons.append(status)
+            continue
+        summary = normalize_name(event.get("summary", ""))
+        if summary_set and summary not in summary_set:
+            invalid_reasons.append('summary not in summary_set')
+            continue
+        if 'dateTime' not in event.get('start', {}):
+            invalid_reasons.append("all day event")
+            continue
+        start_time = get_event_start_datetime(event)
+        if start_time > max_start_time:
+            invalid_reasons.append(f"beyond bookable range")
+            continue
+        valid_events.append(event)
+    if not n_events:
+        logger.warning("Did not find any events in default Google Calendar")
+        return []
+    if not valid_events:
+        logger.debug(
+            "Found %d events in calendar, but none of them are valid", n_events
+        )
+    logger.info(f"Found {len(valid_events)} valid events in calendar")
+    logger.info(f"Filtered {len(invalid_reasons)} events out as invalid")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Invalid reasons: {dict(Counter(invalid_reasons))}")
+    return valid_events
+
+
+def filter_summaries(events: List[dict], summary_set: Set[str]) -> List[dict]:
+    """Events whose summary is in the summary set, once normalized"""
+    summary_set = {normalize_name(summary) for summary in summary_set}
+    kept = [
+        event for event in events
+        if normalize_name(event.get("summary", "")) in summary_set
+    ]
+    logger.debug(
+        "Kept %d of %d events with a class's summary", len(kept), len(events)
+    )
+    return kept
+
+
+@metrics.timed("get_next_events")
 def get_next_events(
-        service: Resource,
+        service: "Resource",
         summary_set: Optional[Set[str]] = None,
         bookable_range: int = default_config_vals['bookable_range'],
-        max_results: int = default_config_vals['max_results']
+        max_results: int = default_config_vals['max_results'],
+        sync: bool = False,
+        horizon: Optional[datetime.timedelta] = None,
+        store_path: Optional[Path] = None
 ) -> List[dict]:
+    """Upcoming events in the default calendar matching the summary set
+
+    Args:
+        service: Google Calendar service from `get_service`
+        summary_set: summaries to keep, all events are kept if None
+        bookable_range: how far out in days classes can be booked
+        max_results: events fetched per page
+        sync: if True, only fetch changes since the last run into the local
+            event store (`cal_sync`) and filter the stored events
+        horizon: how far from now events can start, defaults to
+            `bookable_range` days
+        store_path: event store to sync into, see `cal_sync.sync_events`
+    """
+    from googleapiclient.errors import HttpError
+
     logger.info("Getting events from Google Calendar")
     kawrgs = {'bookable_range': bookable_range, 'max_results': max_results}
-    logger.debug(f"Using kwargs: {kawrgs}")
-    # normalize class names
-    if summary_set is not None:
-        summary_set = {summary.lower() for summary in summary_set}
-        logger.debug(f"Using summary set: {summary_set}")
-    else:
-        logger.debug(f"No summary set provided, allowing all summaries.")
+    logger.debug("Using kwargs: %s", kawrgs)
 
+    if horizon is None:
+        horizon = datetime.timedelta(days=bookable_range)
     try:
         now = datetime.datetime.now(datetime.timezone.utc)
-        now_str = now.isoformat()    # 'Z' indicates UTC time
-
-        events_result = service.events().list(
-            calendarId='primary', timeMin=now_str, singleEvents=True,
-            maxResults=max_results, orderBy="startTime"
-        ).execute()
-        events = events_result.get('items', [])
-
-        if not events:
-            logger.warning("Did not find any events in default Google Calendar")
-            return []
-
-        # Prints the start and name of the next 10 events
-        max_start_time = now + datetime.timedelta(1)
-        valid_events = []
-        invalid_reasons = []
-        for event in events:
-            status = event.get('status', 'cancelled')
-            if status == 'cancelled':
-                invalid_reasons.append(status)
-                continue
-            summary = event.get("summary", "").lower()
-            if summary_set and summary not in summary_set:
-                invalid_reasons.append('summary not in summary_set')
-                continue
-            start_time = get_event_start_datetime(event)
-            if start_time > max_start_time:
-                invalid_reasons.append(f"beyond bookable range")
-                continue
-            valid_events.append(event)
-        if not valid_events:
-            logger.debug(
-                f"Found {len(events)} events in calendar, but none of them are "
-                f"valid"
-            )
-        logger.info(f"Found {len(valid_events)} valid events in calendar")
-        logger.info(f"Filtered {len(invalid_reasons)} events out as invalid")
-        logger.debug(f"Invalid reasons: {dict(Counter(invalid_reasons))}")
-        return valid_events
+        if sync:
+            events = cal_sync.sync_events(service, store_path)
+        else:
+            events = iter_events(service, now, now + horizon, max_results)
+
+        return filter_events(events, now, summary_set, horizon)
 
     except HttpError as exc:
         logger.exception("Encountered an error during calendar read")
@@ -126,6 +321,7 @@ def get_next_events(
 
 
 if __name__ == '__main__':
+    setup_logging()
     service = get_service()
     cal_events = get_next_events(service, {"Boxing All Levels"})
     for cal_event in cal_events:
@@ -0,0 +1,199 @@
+"""Incremental Google Calendar sync into a local event store.
+
+The first sync lists every event page by page and keeps the `nextSyncToken`
+the API returns with the last page. Later syncs send that token and only
+receive events changed since, which are merged into the store. If Google
+expires the token (HTTP 410) the store is cleared and a full sync is done.
+"""
+import datetime
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, TYPE_CHECKING
+
+from clubready_booker import metrics
+from clubready_booker.util import atomic_write, get_config_location
+
+if TYPE_CHECKING:
+    from googleapiclient.discovery import Resource
+
+logger = logging.getLogger(__name__)
+
+STORE_FILENAME = "calendar_events.json"
+ACCOUNT_STORE_FILENAME = "calendar_events_{}.json"
+STORE_VERSION = 1
+PAGE_SIZE = 250
+# the parts of events lists anything here reads, the API sends only these.
+# Responses are already gzipped: httplib2 sends Accept-Encoding and
+# googleapiclient adds "(gzip)" to the User-Agent as Google asks
+LIST_FIELDS = "nextPageToken,nextSyncToken,items(id,status,summary,start,end)"
+
+
+class EventStore:
+    """Events of one calendar and the token to sync them from
+
+    Args:
+        path: location of the store file
+        calendar_id: calendar the events belong to
+    """
+
+    def __init__(self, path: Path, calendar_id: str = 'primary'):
+        self.path = path
+        self.calendar_id = calendar_id
+        self.sync_token: Optional[str] = None
+        self.events: Dict[str, dict] = {}
+
+    @classmethod
+    def load(cls, path: Path, calendar_id: str = 'primary') -> "EventStore":
+        store = cls(path, calendar_id)
+        if not path.exists():
+            return store
+        try:
+            with path.open('r') as f:
+                contents = json.load(f)
+        except (OSError, ValueError):
+            logger.warning(f"Ignoring unreadable calendar event store {path}")
+            return store
+        if contents.get('version') != STORE_VERSION or \
+                contents.get('calendar_id') != calendar_id:
+            logger.info(f"Ignoring calendar event store for another calendar")
+            return store
+        store.sync_token = contents['sync_token']
+        store.events = contents['events']
+        return store
+
+    def save(self) -> None:
+        atomic_write(self.path, json.dumps({
+            'version': STORE_VERSION,
+            'calendar_id': self.calendar_id,
+            'sync_token': self.sync_token,
+            'events': self.events
+        }))
+
+    def clear(self) -> None:
+        self.sync_token = None
+        self.events = {}
+
+    def apply(self, event: dict) -> None:
+        if event.get('status') == 'cancelled':
+            self.events.pop(event['id'], None)
+        else:
+            self.events[event['id']] = event
+
+    def prune(self, before: datetime.datetime) -> int:
+        """Drop events that ended before `before`, they can't be booked, and
+        return how many were dropped
+
+        All day events end on the day after their last, which is compared to
+        `before`'s date, so they may be kept a day longer in some timezones.
+        """
+        pruned = 0
+        for event_id, event in list(self.events.items()):
+            end = event.get('end', {})
+            if end.get('dateTime'):
+                ended_at = datetime.datetime.fromisoformat(end['dateTime'])
+                ended = ended_at < before
+            elif end.get('date'):
+                ended_on = datetime.date.fromisoformat(end['date'])
+                ended = ended_on < before.date()
+            else:
+                continue
+            if ended:
+                del self.events[event_id]
+                pruned += 1
+        return pruned
+
+    def sorted_events(self) -> List[dict]:
+        """Events ordered by start, like the API's orderBy=startTime"""
+        return sorted(self.events.values(), key=_start_instant)
+
+
+def _start_instant(event: dict) -> datetime.datetime:
+    start = event.get('start', {})
+    if start.get('dateTime'):
+        return datetime.datetime.fromisoformat(start['dateTime'])
+    # all day events
+    day = datetime.date.fromisoformat(start.get('date', "1970-01-01"))
+    return datetime.datetime(
+        day.year, day.month, day.day, tzinfo=datetime.timezone.utc
+    )
+
+
+def store_path_for(token_filename: Optional[str] = None) -> Path:
+    """Event store for the calendar account with this OAuth token file, the
+    default store for the default token"""
+    config_dir = get_config_location()
+    if not token_filename:
+        return config_dir.joinpath(STORE_FILENAME)
+    account = Path(token_filename).stem
+    return config_dir.joinpath(ACCOUNT_STORE_FILENAME.format(account))
+
+
+def list_pages(service: "Resource", **kwargs) -> Iterator[Dict[str, Any]]:
+    """Every page of an events().list call"""
+    page = service.events().list(**kwargs).execute()
+    yield page
+    while page.get('nextPageToken'):
+        page = service.events().list(
+            pageToken=page['nextPageToken'], **kwargs
+        ).execute()
+        yield page
+
+
+def sync_events(
+        service: "Resource",
+        path: Optional[Path] = None,
+        calendar_id: str = 'primary'
+) -> List[dict]:
+    """Bring the local store up to date and return its events by start time
+
+    Args:
+        service: Google Calendar service from `cal.get_service`
+        path: store file, defaults to `STORE_FILENAME` in the config dir
+        calendar_id: calendar to sync
+    """
+    from googleapiclient.errors import HttpError
+
+    if path is None:
+        path = get_config_location().joinpath(STORE_FILENAME)
+    store = EventStore.load(path, calendar_id)
+    sync_token = store.sync_token
+    kwargs = {
+        'calendarId': calendar_id,
+        'singleEvents': True,
+        'maxResults': PAGE_SIZE,
+        'fields': LIST_FIELDS
+    }
+    try:
+        changed = _sync(service, store, kwargs)
+    except HttpError as exc:
+        if exc.resp.status != 410:
+            raise exc
+        logger.info("Calendar sync token expired, doing a full sync")
+        store.clear()
+        changed = _sync(service, store, kwargs)
+    pruned = store.prune(datetime.datetime.now(datetime.timezone.utc))
+    if changed or pruned or store.sync_token != sync_token:
+        store.save()
+    logger.info(
+        f"Synced {changed} changed events, {len(store.events)} events stored"
+    )
+    return store.sorted_events()
+
+
+def _sync(service: "Resource", store: EventStore, kwargs: Dict[str, Any]) -> int:
+    if store.sync_token is not None:
+        kwargs = {**kwargs, 'syncToken': store.sync_token}
+    else:
+        logger.info("No calendar sync token, doing a full sync")
+    changed = 0
+    next_sync_token = None
+    for page in list_pages(service, **kwargs):
+        items = page.get('items', [])
+        metrics.count("events_fetched", len(items))
+        for event in items:
+            store.apply(event)
+        changed += len(items)
+        next_sync_token = page.get('nextSyncToken', next_sync_token)
+    store.sync_token = next_sync_token
+    return changed
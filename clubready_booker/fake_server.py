@@ -0,0 +1,451 @@
+"""A local stand-in for the ClubReady site.
+
+Serves just enough of the site for the package to run against it: a login
+form, a `classes.asp` schedule with `#weekrange` and `#scheduleRow`, and the
+booking popup with `#bookbutton` and `MB_close`, which the schedule's book
+buttons open in place with javascript like the real site, so both the http and
+selenium backends work. Useful for development without hitting the real site.
+
+    with serve() as server:
+        config['url'] = server.login_url
+        config['base_url'] = server.base_url
+
+For load testing, `FakeClubReady` takes any number of accounts, who compete
+for the same spots, and a latency added to every response. Or from the command
+line:
+
+    python -m clubready_booker.fake_server [--port 8000] [--latency 0.1]
+                                           [--accounts 20] [--class-size 20]
+"""
+import argparse
+import contextlib
+import html
+import itertools
+import logging
+import random
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+from http import cookies
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+USERNAME = "member@example.com"
+PASSWORD = "hunter2"
+SESSION_COOKIE = "ASP.NET_SessionId"
+CLASS_NAMES = [
+    "Boxing All Levels", "Kickboxing Fundamentals", "Strength & Conditioning",
+    "Heavy Bag Intervals", "Open Gym", "Sparring: Advanced",
+    "Mobility and Stretch", "Conditioning Circuit"
+]
+INSTRUCTORS = ["Jane Doe", "John Roe", "Alex Poe", "Sam Moe"]
+START_HOURS = [6, 7, 9, 12, 16, 17, 18, 19]
+# same as webpage.WEEK_PARAM
+WEEK_PARAM = "wkdate"
+
+
+class FakeClass:
+
+    def __init__(
+            self,
+            schedule_id: int,
+            day: date,
+            hour: int,
+            minute: int,
+            class_name: str,
+            instructor: str,
+            duration_mins: int = 60,
+            registered: int = 0,
+            class_size: int = 20
+    ):
+        self.schedule_id = schedule_id
+        self.day = day
+        self.hour = hour
+        self.minute = minute
+        self.class_name = class_name
+        self.instructor = instructor
+        self.duration_mins = duration_mins
+        self.registered = registered
+        self.class_size = class_size
+        self.booked_by = set()
+        self.wait_list = []
+
+    @property
+    def time_str(self) -> str:
+        return f"{(self.hour - 1) % 12 + 1}:{self.minute:02d} " \
+               f"{'AM' if self.hour < 12 else 'PM'}"
+
+    @property
+    def duration_str(self) -> str:
+        hours, mins = divmod(self.duration_mins, 60)
+        parts = []
+        if hours:
+            parts.append(f"{hours} hour{'s' if hours > 1 else ''}")
+        if mins:
+            parts.append(f"{mins} mins")
+        return " ".join(parts)
+
+    @property
+    def onclick(self) -> str:
+        return f"ShowClassBook({self.schedule_id}); return false;"
+
+
+def week_start(day: date) -> date:
+    """ClubReady weeks start on Sunday"""
+    return day - timedelta(days=(day.weekday() + 1) % 7)
+
+
+def generate_schedule(
+        start: date,
+        weeks: int = 1,
+        classes_per_day: int = 6,
+        class_size: int = 20,
+        seed: int = 0
+) -> List[FakeClass]:
+    """Deterministic schedule starting on the week containing `start`"""
+    first_day = week_start(start)
+    schedule = []
+    schedule_ids = itertools.count(1000)
+    for day_idx in range(weeks * 7):
+        day = first_day + timedelta(days=day_idx)
+        for class_idx in range(classes_per_day):
+            n = seed + day_idx * classes_per_day + class_idx
+            hour = START_HOURS[class_idx % len(START_HOURS)]
+            minute = (class_idx // len(START_HOURS)) % 60
+            # very large schedules get numbered sessions so that no two classes
+            # share a name and start time
+            session = class_idx // (len(START_HOURS) * 60)
+            class_name = CLASS_NAMES[n % len(CLASS_NAMES)]
+            if session:
+                class_name = f"{class_name} Session {session}"
+            schedule.append(FakeClass(
+                schedule_id=next(schedule_ids),
+                day=day,
+                hour=hour,
+                minute=minute,
+                class_name=class_name,
+                instructor=INSTRUCTORS[n % len(INSTRUCTORS)],
+                duration_mins=(45, 60, 90)[n % 3],
+                registered=(n * 7) % (class_size + 1),
+                class_size=class_size
+            ))
+    return schedule
+
+
+def render_class(fake_class: FakeClass) -> str:
+    return (
+        '<div class="scheduleClass">'
+        f'<span class="time">{fake_class.time_str}</span>\n'
+        f'<span class="name">{html.escape(fake_class.class_name)}</span>\n'
+        f'<span class="duration">{fake_class.duration_str}</span>\n'
+        f'<a href="javascript:showbio({fake_class.schedule_id % 97})">'
+        f'{html.escape(fake_class.instructor)}</a>\n'
+        f'<span>{fake_class.registered} / {fake_class.class_size} '
+        f'spaces occupied</span>\n'
+        f'<a href="#" title="Book A Place In This Class" '
+        f'onclick="{html.escape(fake_class.onclick)}">Book</a>'
+        '</div>\n'
+    )
+
+
+def render_schedule(first_day: date, schedule: List[FakeClass]) -> str:
+    """Render the body of classes.asp for the week starting on `first_day`"""
+    last_day = first_day + timedelta(days=6)
+    by_day: Dict[date, List[FakeClass]] = {}
+    for fake_class in schedule:
+        by_day.setdefault(fake_class.day, []).append(fake_class)
+    columns = []
+    for day_idx in range(7):
+        day = first_day + timedelta(days=day_idx)
+        classes = sorted(
+            by_day.get(day, []), key=lambda c: (c.hour, c.minute)
+        )
+        columns.append(
+            '<div class="scheduleCol"><table><tr><td>\n'
+            + "".join(map(render_class, classes))
+            + '</td></tr></table></div>\n'
+        )
+    return (
+        "<html><head><title>Classes</title>\n" + SCHEDULE_SCRIPT
+        + "</head><body>\n"
+        f'<span id="weekrange">{first_day:%m/%d/%Y} - {last_day:%m/%d/%Y}'
+        '</span>\n'
+        '<div id="scheduleRow">\n' + "".join(columns) + "</div>\n"
+        "</body></html>"
+    )
+
+
+LOGIN_PAGE = """<html><body>
+<form method="post" action="/login">
+<input type="hidden" name="__VIEWSTATE" value="fake">
+<input id="uid" name="uid" type="text">
+<input id="pw" name="pw" type="password">
+<input class="loginbutt" type="submit" name="login" value="Log In">
+</form></body></html>"""
+
+# opens the booking popup over the schedule and submits it without leaving the
+# page, showing the answer in place of the form, enough of what the real
+# site's scripts do for selenium to book
+SCHEDULE_SCRIPT = """<script>
+function ShowClassBook(scheduleId) {
+  var request = new XMLHttpRequest();
+  request.open("GET", "bookclass.asp?schedid=" + scheduleId);
+  request.onload = function () {
+    var holder = document.createElement("div");
+    holder.innerHTML = request.responseText;
+    var popup = holder.querySelector("#MB_window");
+    document.body.appendChild(popup);
+    var form = popup.querySelector("form");
+    form.addEventListener("submit", function (event) {
+      event.preventDefault();
+      var post = new XMLHttpRequest();
+      post.open("POST", form.getAttribute("action"));
+      post.setRequestHeader(
+        "Content-Type", "application/x-www-form-urlencoded"
+      );
+      post.onload = function () {
+        var result = document.createElement("div");
+        result.innerHTML = post.responseText;
+        form.replaceWith(result);
+      };
+      post.send(new URLSearchParams(new FormData(form)).toString());
+    });
+    var close = popup.querySelector("#MB_close");
+    close.addEventListener("click", function (event) {
+      event.preventDefault();
+      popup.remove();
+    });
+  };
+  request.send();
+}
+</script>
+"""
+
+POPUP_PAGE = """<html><body>
+<div id="MB_window">
+<form method="post" action="bookclass.asp">
+<input type="hidden" name="schedid" value="{schedule_id}">
+<div id="bookbutton"><input type="submit" name="book" value="{action}"></div>
+</form>
+<a id="MB_close" href="#">close</a>
+</div></body></html>"""
+
+
+def member_accounts(n: int) -> Dict[str, str]:
+    """n accounts, member0@example.com and so on, all with `PASSWORD`"""
+    return {f"member{i}@example.com": PASSWORD for i in range(n)}
+
+
+class FakeClubReady:
+    """State of the fake site, shared between request handler threads
+
+    Args:
+        schedule: classes on the site, two weeks of six a day by default
+        accounts: username to password of everyone who can log in, just
+            `USERNAME` by default
+        latency: seconds added to every response
+        jitter: most seconds the latency varies by either way
+        seed: for the jitter
+    """
+
+    def __init__(
+            self,
+            schedule: Optional[List[FakeClass]] = None,
+            accounts: Optional[Dict[str, str]] = None,
+            latency: float = 0.0,
+            jitter: float = 0.0,
+            seed: int = 0
+    ):
+        self.schedule = schedule if schedule is not None else \
+            generate_schedule(date.today(), weeks=2)
+        self.by_id = {c.schedule_id: c for c in self.schedule}
+        self.accounts = accounts if accounts is not None else \
+            {USERNAME: PASSWORD}
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.sessions: Dict[str, str] = {}
+        self.lock = threading.Lock()
+
+    def delay(self) -> None:
+        """Wait as long as a response from the real site might take"""
+        if self.latency or self.jitter:
+            with self.lock:
+                offset = self.random.uniform(-self.jitter, self.jitter)
+            time.sleep(max(0.0, self.latency + offset))
+
+    def login(self, username: str, password: str) -> Optional[str]:
+        if username not in self.accounts or \
+                self.accounts[username] != password:
+            return None
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.sessions[token] = username
+        return token
+
+    def book(self, schedule_id: int, username: str) -> str:
+        with self.lock:
+            fake_class = self.by_id[schedule_id]
+            if username in fake_class.booked_by:
+                return "already booked"
+            if fake_class.registered < fake_class.class_size:
+                fake_class.registered += 1
+                fake_class.booked_by.add(username)
+                return "booked"
+            fake_class.wait_list.append(username)
+            return "waitlisted"
+
+
+class FakeClubReadyHandler(BaseHTTPRequestHandler):
+    site: FakeClubReady = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def _send(self, status: int, body: str = "", headers=None):
+        encoded = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(encoded)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def _redirect(self, location: str, headers=None):
+        self._send(302, headers={"Location": location, **(headers or {})})
+
+    def _form(self) -> Dict[str, str]:
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode()
+        return {k: v[-1] for k, v in parse_qs(body).items()}
+
+    def _user(self) -> Optional[str]:
+        jar = cookies.SimpleCookie(self.headers.get("Cookie", ""))
+        if SESSION_COOKIE not in jar:
+            return None
+        return self.site.sessions.get(jar[SESSION_COOKIE].value)
+
+    def do_GET(self):
+        self.site.delay()
+        url = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if url.path == "/login":
+            return self._send(200, LOGIN_PAGE)
+        user = self._user()
+        if user is None:
+            return self._redirect("/login")
+        if url.path == "/clients/classes.asp":
+            if WEEK_PARAM in query:
+                month, day, year = map(int, query[WEEK_PARAM].split("/"))
+                first_day = week_start(date(year, month, day))
+            else:
+                first_day = week_start(date.today())
+            return self._send(200, render_schedule(first_day, self.site.schedule))
+        if url.path == "/clients/bookclass.asp":
+            fake_class = self.site.by_id.get(int(query.get("schedid", -1)))
+            if fake_class is None:
+                return self._send(404, "no such class")
+            full = fake_class.registered >= fake_class.class_size
+            return self._send(200, POPUP_PAGE.format(
+                schedule_id=fake_class.schedule_id,
+                action="Join Wait List" if full else "Book Now"
+            ))
+        return self._send(404, "not found")
+
+    def do_POST(self):
+        self.site.delay()
+        url = urlsplit(self.path)
+        form = self._form()
+        if url.path == "/login":
+            token = self.site.login(form.get("uid"), form.get("pw"))
+            if token is None:
+                return self._send(200, LOGIN_PAGE)
+            return self._redirect("/clients/classes.asp", {
+                "Set-Cookie": f"{SESSION_COOKIE}={token}; Path=/; HttpOnly"
+            })
+        user = self._user()
+        if user is None:
+            return self._redirect("/login")
+        if url.path == "/clients/bookclass.asp":
+            schedule_id = int(form.get("schedid", -1))
+            if schedule_id not in self.site.by_id:
+                return self._send(404, "no such class")
+            result = self.site.book(schedule_id, user)
+            return self._send(200, f'<div id="bookresult">{result}</div>')
+        return self._send(404, "not found")
+
+
+class FakeServer:
+
+    def __init__(self, httpd: ThreadingHTTPServer, site: FakeClubReady):
+        self.httpd = httpd
+        self.site = site
+        host, port = httpd.server_address[:2]
+        self.root_url = f"http://{host}:{port}"
+
+    @property
+    def login_url(self) -> str:
+        return self.root_url + "/login"
+
+    @property
+    def base_url(self) -> str:
+        return self.root_url + "/clients"
+
+
+@contextlib.contextmanager
+def serve(
+        site: Optional[FakeClubReady] = None,
+        host: str = "127.0.0.1",
+        port: int = 0
+) -> Iterator[FakeServer]:
+    """Run the fake site on a background thread for the duration of the block"""
+    site = site if site is not None else FakeClubReady()
+    handler = type(
+        "BoundFakeClubReadyHandler", (FakeClubReadyHandler,), {"site": site}
+    )
+    httpd = ThreadingHTTPServer((host, port), handler)
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield FakeServer(httpd, site)
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        thread.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a fake ClubReady")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--weeks", type=int, default=2)
+    parser.add_argument("--classes-per-day", type=int, default=6)
+    parser.add_argument("--class-size", type=int, default=20)
+    parser.add_argument(
+        "--accounts", type=int, default=0,
+        help=f"member0@example.com and so on, all with password {PASSWORD}, "
+             f"as well as {USERNAME}"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    accounts = {USERNAME: PASSWORD, **member_accounts(args.accounts)}
+    site = FakeClubReady(
+        generate_schedule(
+            date.today(), args.weeks, args.classes_per_day, args.class_size
+        ),
+        accounts, args.latency, args.jitter
+    )
+    with serve(site, port=args.port) as fake_server:
+        logger.info(
+            f"Serving fake ClubReady at {fake_server.login_url}, log in with "
+            f"{USERNAME} / {PASSWORD}"
+        )
+        threading.Event().wait()
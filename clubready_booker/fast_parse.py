@@ -0,0 +1,240 @@
+"""Single pass class schedule parser built directly on lxml.
+
+Produces exactly the same output as `webpage.parse_class_columns`, but skips
+building a BeautifulSoup tree and does the per-class setup (timezone lookup,
+`now`, regex compilation) once per page instead of once per class.
+"""
+import hashlib
+import logging
+import re
+import time
+from datetime import date, datetime, timedelta
+from string import punctuation
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import lxml.html
+import pytz
+from lxml import etree
+
+from clubready_booker import records
+from clubready_booker.records import ClassRecord
+
+logger = logging.getLogger(__name__)
+
+# keep in step with webpage
+WS = re.compile(r"^\s+$")
+DURATION = re.compile(r"(\d+)\s+(hour(s)?|min(s)?)", re.IGNORECASE)
+BOOKED_PROPORTION = re.compile(r'(\d+) / (\d+)')
+CLOCK_TIME = re.compile(r"(\d{1,2}):(\d{2}) ([AP]M)")
+BUTTON_TITLE = 'Book A Place In This Class'
+# BeautifulSoup leaves the contents of these out of `.strings` and `.text`
+SKIPPED_TAGS = frozenset(("script", "style", "template"))
+
+
+def iter_strings(elem: etree.ElementBase) -> Iterator[str]:
+    """Text nodes under elem in document order, matching bs4's `.strings`"""
+    if isinstance(elem.tag, str) and elem.tag not in SKIPPED_TAGS:
+        if elem.text:
+            yield elem.text
+        for child in elem:
+            yield from iter_strings(child)
+            if child.tail:
+                yield child.tail
+
+
+def element_text(elem: etree.ElementBase) -> str:
+    return "".join(iter_strings(elem))
+
+
+def column_fingerprint(col_elem: etree.ElementBase) -> str:
+    """Hash of a schedule column's html
+
+    Not comparable with `webpage.column_fingerprint`, so switching parsers
+    re-parses every cached column once.
+    """
+    return hashlib.sha1(
+        etree.tostring(col_elem, with_tail=False, encoding="utf-8")
+    ).hexdigest()
+
+
+class ClassParser:
+    """Parses class elements for one schedule page
+
+    Args:
+        timezone: timezone for the class times in the class schedule
+        now: time to compare class times against, defaults to the current
+            time, localized the same way `webpage.parse_class_elem` does
+    """
+
+    def __init__(self, timezone: str, now: Optional[datetime] = None):
+        self.tz = pytz.timezone(timezone)
+        self.now = now if now is not None else self.tz.localize(datetime.now())
+        self._localized: Dict[Tuple[date, int, int], datetime] = {}
+        self.keep_texts = records.keep_texts()
+
+    def start_time(self, text: str, column_date: date) -> datetime:
+        if match := CLOCK_TIME.fullmatch(text):
+            hour, minute = int(match.group(1)), int(match.group(2))
+            if not (1 <= hour <= 12 and minute < 60):
+                match = None
+        if match:
+            hour = hour % 12 + (12 if match.group(3) == "PM" else 0)
+        else:
+            # anything unusual goes through the same path as the bs4 parser
+            parsed = time.strptime(text, "%I:%M %p")
+            hour, minute = parsed.tm_hour, parsed.tm_min
+        key = (column_date, hour, minute)
+        if (localized := self._localized.get(key)) is None:
+            localized = self.tz.localize(datetime(
+                column_date.year, column_date.month, column_date.day,
+                hour, minute
+            ))
+            self._localized[key] = localized
+        return localized
+
+    def parse(
+            self,
+            class_elem: etree.ElementBase,
+            column_date: date,
+            class_idx: int
+    ) -> ClassRecord:
+        try:
+            texts = [
+                s.strip() for s in iter_strings(class_elem)
+                if WS.match(s) is None
+            ]
+            class_start = None
+            class_end = None
+            duration = None
+            class_name_strs = []
+            registered = None
+            class_size = None
+            class_name = None
+            instructor = None
+            booking_id = None
+            for text in texts:
+                if "AM" in text or "PM" in text:
+                    if class_start is not None:
+                        logger.warning(
+                            f"Found more than one time for class with "
+                            f"index {class_idx} in column with date "
+                            f"{column_date}. Already have: {class_start}, "
+                            f"found {text}"
+                        )
+                        continue
+                    class_start = self.start_time(text, column_date)
+                    continue
+                if matches := list(DURATION.finditer(text)):
+                    duration = text
+                    class_end = class_start
+                    for match in matches:
+                        duration_num = int(match.group(1))
+                        if match.group(2).lower().startswith("hour"):
+                            class_end = class_end + timedelta(hours=duration_num)
+                        else:
+                            class_end = class_end + timedelta(
+                                minutes=duration_num
+                            )
+                    continue
+                if not duration:
+                    # class names can be multiple lines
+                    class_name_strs.append(text)
+                elif class_name is None:
+                    class_name = " ".join(class_name_strs).strip(punctuation)
+                if "spaces occupied" in text:
+                    booked_proportion = BOOKED_PROPORTION.search(text)
+                    registered = int(booked_proportion.group(1))
+                    class_size = int(booked_proportion.group(2))
+            if class_name_strs and not class_name:
+                class_name = " ".join(class_name_strs).strip(punctuation)
+            # one walk finds both the instructor bio link and the book button
+            for desc in class_elem.iterdescendants():
+                if not isinstance(desc.tag, str):
+                    continue
+                if instructor is None and "showbio" in desc.get('href', ""):
+                    instructor = element_text(desc)
+                if booking_id is None and desc.get('title') == BUTTON_TITLE:
+                    booking_id = desc.get('onclick')
+                    # bs4's find stops at the first match even without onclick
+                    if booking_id is None:
+                        booking_id = False
+            if booking_id is False:
+                booking_id = None
+            now = self.now
+            ended = class_end < now if class_end else True
+            started = class_start < now if class_start else True
+            if class_size is not None and registered is not None:
+                spots_available = (class_size - registered) > 0
+            else:
+                spots_available = None
+            return ClassRecord(
+                start_time=class_start,
+                started=started,
+                end_time=class_end,
+                ended=ended,
+                class_name=class_name,
+                duration=duration,
+                instructor=instructor,
+                registered=registered,
+                class_size=class_size,
+                spots_available=spots_available,
+                booking_id=booking_id,
+                texts=texts if self.keep_texts else None
+            )
+        except Exception as exc:
+            logger.exception("Encountered an error during class parsing")
+            raise exc
+
+
+def parse_class_columns(
+        src: str,
+        timezone: str,
+        cached_columns: Optional[Dict[str, Dict[str, Any]]] = None,
+        now: Optional[datetime] = None
+) -> Tuple[List[date], Dict[str, Dict[str, Any]]]:
+    """Drop in replacement for `webpage.parse_class_columns`"""
+    page = lxml.html.fromstring(src)
+    week_range = page.xpath("//*[@id='weekrange']")[0]
+    date_span = []
+    for date_str in element_text(week_range).split(" - "):
+        month, day, year = map(int, date_str.strip().split("/"))
+        date_span.append(date(year, month, day))
+
+    assert date_span[0] < date_span[1], f"Date span invalid: {date_span}"
+    n_days = (date_span[1] - date_span[0]).days + 1
+    all_dates = [date_span[0] + timedelta(days=i) for i in range(n_days)]
+
+    schedule = page.xpath("//*[@id='scheduleRow']")[0]
+    col_elems = [child for child in schedule if isinstance(child.tag, str)]
+
+    assert len(all_dates) == len(col_elems), (
+        f"Dates and Cols not the same len: {len(all_dates)} != {len(col_elems)}"
+    )
+    parser = ClassParser(timezone, now)
+    columns = {}
+    reused = 0
+    for column_date, col_elem in zip(all_dates, col_elems):
+        column_key = column_date.isoformat()
+        fingerprint = None
+        if cached_columns is not None:
+            fingerprint = column_fingerprint(col_elem)
+            cached = cached_columns.get(column_key)
+            if cached is not None and cached['fingerprint'] == fingerprint:
+                columns[column_key] = cached
+                reused += 1
+                continue
+        td = next(col_elem.iterdescendants("td"))
+        class_elems = [child for child in td if child.tag == "div"]
+        columns[column_key] = {
+            'fingerprint': fingerprint,
+            'classes': [
+                parser.parse(class_elem, column_date, class_idx)
+                for class_idx, class_elem in enumerate(class_elems)
+            ]
+        }
+    if cached_columns is not None:
+        logger.debug(
+            "Reused %d of %d unchanged columns for week of %s", reused,
+            len(columns), date_span[0]
+        )
+    return date_span, columns
@@ -0,0 +1,252 @@
+"""HTTP-only backend for ClubReady, no browser required.
+
+`ClubReadySession` exposes the small part of the selenium `WebDriver` API that
+the rest of the package relies on (`current_url`, `page_source`, `get`,
+`close`), so it can be handed to the functions in `webpage` in place of a
+driver.
+"""
+import logging
+import re
+from typing import Any, Dict, List, Optional, TYPE_CHECKING
+from urllib.parse import urljoin
+
+# requests and bs4 are imported when a session is first used, so importing
+# this module for `isinstance` checks stays cheap
+if TYPE_CHECKING:
+    import requests
+    from bs4.element import Tag
+
+logger = logging.getLogger(__name__)
+
+# booking buttons open the popup either with an explicit url, something like
+# onclick="MB_Show('bookclass.asp?schedid=123')", or with just the schedule id,
+# onclick="ShowClassBook(123); return false;"
+POPUP_URL = re.compile(r"""['"]([^'"]+\.asp[^'"]*)['"]""", re.IGNORECASE)
+SCHEDULE_ID = re.compile(r"(\d+)")
+POPUP_FALLBACK_PATH = "bookclass.asp?schedid={}"
+# what ClubReady shows in place of the booking form when it turns one down
+REJECTED = re.compile(
+    r"already (booked|registered|enrolled|signed up)|unable to (book|register)"
+    r"|cannot (book|register)|not eligible|no longer available",
+    re.IGNORECASE
+)
+USER_AGENT = (
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/120.0 Safari/537.36"
+)
+
+
+class LoginError(Exception):
+    """Raised when ClubReady does not accept the supplied credentials"""
+
+
+class BookingRejected(Exception):
+    """Raised when ClubReady turns down a booking"""
+
+
+class ClubReadySession:
+    """Keep-alive requests session that stands in for a selenium WebDriver
+
+    Args:
+        url: login page url, same as the `url` config value
+        base_url: url of the ClubReady clients app, classes.asp lives here
+        timeout: seconds to wait on any single request
+        pool_size: number of keep-alive connections to hold open
+    """
+
+    def __init__(
+            self,
+            url: str,
+            base_url: str,
+            timeout: float = 15,
+            pool_size: int = 4
+    ):
+        self.url = url
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.current_url: Optional[str] = None
+        self.page_source: Optional[str] = None
+
+    @property
+    def classes_url(self) -> str:
+        return self.base_url + "/classes.asp"
+
+    def _request(self, method: str, url: str, **kwargs) -> "requests.Response":
+        response = self.session.request(
+            method, url, timeout=self.timeout, **kwargs
+        )
+        response.raise_for_status()
+        self.current_url = response.url
+        self.page_source = response.text
+        return response
+
+    def get(self, url: str, **kwargs) -> "requests.Response":
+        return self._request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> "requests.Response":
+        return self._request("POST", url, **kwargs)
+
+    def fetch(self, url: str, **kwargs) -> str:
+        """GET a page without making it the current page, safe to call from
+        several threads at once"""
+        response = self.session.get(url, timeout=self.timeout, **kwargs)
+        response.raise_for_status()
+        return response.text
+
+    def submit_form(
+            self,
+            form: "Tag",
+            page_url: str,
+            fields: Optional[Dict[str, str]] = None
+    ) -> "requests.Response":
+        """Submit an html form the same way a browser would"""
+        data = form_fields(form)
+        data.update(fields or {})
+        action = urljoin(page_url, form.attrs.get("action") or page_url)
+        if form.attrs.get("method", "get").lower() == "post":
+            return self.post(action, data=data)
+        return self.get(action, params=data)
+
+    def login(self, username: str, password: str) -> None:
+        from bs4 import BeautifulSoup
+
+        self.get(self.url)
+        page = BeautifulSoup(self.page_source, features="lxml")
+        uid_form = page.find(id="uid")
+        pw_form = page.find(id="pw")
+        form = uid_form.find_parent("form") if uid_form is not None else None
+        if form is None or pw_form is None:
+            raise LoginError(f"Could not find the login form at {self.url}")
+        fields = {
+            uid_form.attrs.get("name", "uid"): username,
+            pw_form.attrs.get("name", "pw"): password
+        }
+        submit = form.find(class_="loginbutt")
+        if submit is not None and submit.attrs.get("name"):
+            fields[submit.attrs["name"]] = submit.attrs.get("value", "")
+        self.submit_form(form, self.current_url, fields)
+        # a rejected login sends us back to the form
+        if 'id="uid"' in self.page_source:
+            raise LoginError("ClubReady rejected the login")
+
+    def get_classes_page(self) -> None:
+        if self.current_url != self.classes_url:
+            self.get(self.classes_url)
+
+    def popup_url(self, booking_id: str) -> str:
+        if match := POPUP_URL.search(booking_id):
+            path = match.group(1)
+        elif match := SCHEDULE_ID.search(booking_id):
+            path = POPUP_FALLBACK_PATH.format(match.group(1))
+        else:
+            raise ValueError(f"Cannot find a booking url in {booking_id!r}")
+        return urljoin(self.classes_url, path)
+
+    def book(self, booking_id: str, dry_run: bool = False) -> str:
+        """Load the booking popup for a class and submit it
+
+        The popup for booking and for joining the wait list are the same form,
+        so this handles both.
+
+        Raises:
+            BookingRejected: if the response to the booking says it was
+                turned down
+
+        Returns:
+            "waitlisted" if the popup's button joins the wait list, otherwise
+            "booked"
+        """
+        from bs4 import BeautifulSoup
+
+        popup_url = self.popup_url(booking_id)
+        self.get(popup_url, headers={"Referer": self.classes_url})
+        popup = BeautifulSoup(self.page_source, features="lxml")
+        book_button = popup.find(id="bookbutton")
+        if book_button is None:
+            raise ValueError(f"No #bookbutton in booking popup {popup_url}")
+        popup_input = book_button.find("input")
+        form = book_button.find_parent("form") or book_button.find("form")
+        if form is None:
+            raise ValueError(f"No booking form in booking popup {popup_url}")
+        button_text = popup_input.attrs.get("value", "") if popup_input else ""
+        status = "waitlisted" if "wait" in button_text.lower() else "booked"
+        if dry_run:
+            logger.info("Dry Run - would have booked class")
+            return status
+        fields = {}
+        if popup_input is not None and popup_input.attrs.get("name"):
+            fields[popup_input.attrs["name"]] = button_text
+        self.submit_form(form, popup_url, fields)
+        result = BeautifulSoup(self.page_source, features="lxml")
+        check_booking_result(result.get_text(" "))
+        return status
+
+    def get_cookies(self) -> List[Dict[str, Any]]:
+        """Cookies in the same shape as selenium's `get_cookies`"""
+        return [
+            {
+                'name': cookie.name,
+                'value': cookie.value,
+                'domain': cookie.domain,
+                'path': cookie.path,
+                'secure': cookie.secure,
+                'expiry': cookie.expires
+            }
+            for cookie in self.session.cookies
+        ]
+
+    def add_cookies(self, cookies: List[Dict[str, Any]]) -> None:
+        for cookie in cookies:
+            self.session.cookies.set(
+                cookie['name'],
+                cookie['value'],
+                domain=cookie.get('domain', ""),
+                path=cookie.get('path', "/"),
+                secure=cookie.get('secure', False),
+                expires=cookie.get('expiry')
+            )
+
+    def close(self) -> None:
+        self.session.close()
+
+    def quit(self) -> None:
+        self.close()
+
+
+def form_fields(form: "Tag") -> Dict[str, str]:
+    """Default values of the named, non-button inputs of a form"""
+    fields = {}
+    for input_tag in form.find_all(["input", "select", "textarea"]):
+        name = input_tag.attrs.get("name")
+        input_type = input_tag.attrs.get("type", "text").lower()
+        if not name or input_type in ("submit", "button", "image", "reset"):
+            continue
+        if input_type in ("checkbox", "radio") and \
+                "checked" not in input_tag.attrs:
+            continue
+        fields[name] = input_tag.attrs.get("value", "")
+    return fields
+
+
+def check_booking_result(text: str) -> None:
+    """Raise `BookingRejected` if the text shown after booking says the
+    booking was turned down"""
+    if REJECTED.search(text):
+        raise BookingRejected(" ".join(text.split())[:200])
+
+
+def get_session(url: str, base_url: str) -> ClubReadySession:
+    try:
+        session = ClubReadySession(url, base_url)
+    except Exception as exc:
+        logger.exception("Encountered an error trying to open a session")
+        raise exc
+    return session
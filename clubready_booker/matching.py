@@ -0,0 +1,117 @@
+"""Match Google Calendar events to classes in the class table.
+
+Events and classes are matched on their normalized name and start instant in
+UTC, using a single hash index over the class table, so matching is linear in
+the number of events plus classes.
+"""
+import datetime
+import logging
+import re
+from string import punctuation
+from typing import Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+from clubready_booker.records import ClassRecord
+
+logger = logging.getLogger(__name__)
+
+PUNCTUATION = re.compile(f"[{re.escape(punctuation)}]")
+WHITESPACE = re.compile(r"\s+")
+
+Match = Tuple[dict, ClassRecord]
+
+
+class MatchResult(NamedTuple):
+    # (event, class) pairs, in event order
+    matches: List[Match]
+    unmatched_events: List[dict]
+
+
+def normalize_name(name: Optional[str]) -> str:
+    """Case, punctuation and spacing insensitive form of a class/event name"""
+    if not name:
+        return ""
+    name = PUNCTUATION.sub(" ", name.casefold())
+    return WHITESPACE.sub(" ", name).strip()
+
+
+def utc_instant(date_time: datetime.datetime) -> datetime.datetime:
+    return date_time.astimezone(datetime.timezone.utc)
+
+
+def event_start(event: dict) -> Optional[datetime.datetime]:
+    """Start of a timed event, None for all day events"""
+    start = event.get('start', {}).get('dateTime')
+    return datetime.datetime.fromisoformat(start) if start else None
+
+
+def _bucket(instant: datetime.datetime, tolerance: float) -> int:
+    return int(instant.timestamp() // tolerance)
+
+
+def build_index(
+        class_table: List[ClassRecord],
+        tolerance: float = 0
+) -> Dict[Tuple[str, Hashable], List[ClassRecord]]:
+    """Index classes on (normalized name, start)
+
+    With no tolerance the start is the UTC instant itself, otherwise it is the
+    `tolerance` second wide bucket the start falls in.
+    """
+    index = {}
+    for class_record in class_table:
+        start = class_record.start_time
+        if start is None:
+            continue
+        instant = utc_instant(start)
+        key = instant if not tolerance else _bucket(instant, tolerance)
+        name = normalize_name(class_record.class_name)
+        index.setdefault((name, key), []).append(class_record)
+    return index
+
+
+def match_events(
+        events: List[dict],
+        class_table: List[ClassRecord],
+        tolerance: datetime.timedelta = datetime.timedelta(0)
+) -> MatchResult:
+    """Find the classes for each event
+
+    Args:
+        events: Google Calendar events
+        class_table: classes from `webpage.build_class_table`
+        tolerance: how far apart an event's start and a class's start can be
+            and still match
+    Returns:
+        matched (event, class) pairs and the events with no matching class
+    """
+    tolerance_secs = tolerance.total_seconds()
+    index = build_index(class_table, tolerance_secs)
+    matches = []
+    unmatched = []
+    for event in events:
+        start = event_start(event)
+        if start is None:
+            unmatched.append(event)
+            continue
+        instant = utc_instant(start)
+        name = normalize_name(event.get('summary'))
+        if not tolerance_secs:
+            classes = index.get((name, instant), [])
+        else:
+            bucket = _bucket(instant, tolerance_secs)
+            classes = [
+                class_record
+                for key in (bucket - 1, bucket, bucket + 1)
+                for class_record in index.get((name, key), [])
+                if abs((utc_instant(class_record.start_time) - instant)
+                       .total_seconds()) <= tolerance_secs
+            ]
+        if not classes:
+            unmatched.append(event)
+            continue
+        matches.extend((event, class_record) for class_record in classes)
+    logger.info(
+        f"Matched {len(events) - len(unmatched)} of {len(events)} events to "
+        f"{len(matches)} classes"
+    )
+    return MatchResult(matches, unmatched)
@@ -0,0 +1,212 @@
+"""Per-phase timings and counters, to see where the time of a run went.
+
+Metrics are off unless `metrics` is set in the config. While they are off,
+`span` hands back a shared no-op context manager, `timed` functions call
+straight through and `count` returns at once, so the instrumentation left in
+the code costs a global lookup.
+
+When on, each run writes two files to the config dir:
+
+- `clubready_booker_<entry>.prom`, a Prometheus textfile (for node_exporter's
+  textfile collector) with the totals of the latest run
+- `metrics.jsonl`, one JSON line appended per run with every span, for
+  tracking timings across runs
+"""
+import contextlib
+import functools
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from clubready_booker.util import atomic_write, get_config_location
+
+logger = logging.getLogger(__name__)
+
+PROM_FILENAME = "clubready_booker_{}.prom"
+JSONL_FILENAME = "metrics.jsonl"
+PREFIX = "clubready_booker"
+
+
+class Run:
+    """Spans and counters recorded during one run of an entry point
+
+    Args:
+        entry: name of the entry point, e.g. "booker"
+    """
+
+    def __init__(self, entry: str):
+        self.entry = entry
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        # (name, seconds since the run started, duration in seconds)
+        self.spans: List[Tuple[str, float, float]] = []
+        self.counters: Counter = Counter()
+        self.lock = threading.Lock()
+
+    def add_span(self, name: str, start: float, seconds: float) -> None:
+        with self.lock:
+            self.spans.append((name, start - self.start, seconds))
+
+    def add(self, name: str, n: int = 1) -> None:
+        with self.lock:
+            self.counters[name] += n
+
+    def phases(self) -> Dict[str, Dict[str, float]]:
+        """Total seconds and number of spans per phase"""
+        phases = {}
+        for name, _, seconds in self.spans:
+            phase = phases.setdefault(name, {'count': 0, 'seconds': 0.0})
+            phase['count'] += 1
+            phase['seconds'] += seconds
+        return phases
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'entry': self.entry,
+            'started_at': self.started_at,
+            'seconds': time.perf_counter() - self.start,
+            'phases': self.phases(),
+            'counters': dict(self.counters),
+            'spans': [
+                {'name': name, 'offset': offset, 'seconds': seconds}
+                for name, offset, seconds in self.spans
+            ]
+        }
+
+
+class _Span:
+    __slots__ = ('run', 'name', 'start')
+
+    def __init__(self, run: Run, name: str):
+        self.run = run
+        self.name = name
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.run.add_span(self.name, self.start, time.perf_counter() - self.start)
+
+
+_NO_SPAN = contextlib.nullcontext()
+_run: Optional[Run] = None
+
+
+def enable(entry: str) -> Run:
+    """Start recording a run"""
+    global _run
+    _run = Run(entry)
+    return _run
+
+
+def disable() -> Optional[Run]:
+    """Stop recording, returning the run that was being recorded"""
+    global _run
+    run, _run = _run, None
+    return run
+
+
+def span(name: str):
+    """Context manager timing a phase"""
+    run = _run
+    if run is None:
+        return _NO_SPAN
+    return _Span(run, name)
+
+
+def timed(name: str) -> Callable:
+    """Decorator timing every call of a function as a phase"""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            run = _run
+            if run is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                run.add_span(name, start, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def count(name: str, n: int = 1) -> None:
+    """Add to a counter, e.g. classes parsed or bookings attempted"""
+    run = _run
+    if run is not None:
+        run.add(name, n)
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def prometheus_text(run: Run) -> str:
+    """The run in the Prometheus text exposition format"""
+    entry = _label(run.entry)
+    lines = [
+        f"# HELP {PREFIX}_phase_seconds Seconds spent in each phase of the "
+        f"last run",
+        f"# TYPE {PREFIX}_phase_seconds summary",
+    ]
+    for name, phase in sorted(run.phases().items()):
+        labels = f'entry="{entry}",phase="{_label(name)}"'
+        lines.append(f"{PREFIX}_phase_seconds_sum{{{labels}}} {phase['seconds']}")
+        lines.append(f"{PREFIX}_phase_seconds_count{{{labels}}} {phase['count']}")
+    lines.extend([
+        f"# HELP {PREFIX}_items Counts of things done in the last run",
+        f"# TYPE {PREFIX}_items gauge",
+    ])
+    for name, value in sorted(run.counters.items()):
+        labels = f'entry="{entry}",item="{_label(name)}"'
+        lines.append(f"{PREFIX}_items{{{labels}}} {value}")
+    lines.extend([
+        f"# HELP {PREFIX}_run_seconds Duration of the last run",
+        f"# TYPE {PREFIX}_run_seconds gauge",
+        f'{PREFIX}_run_seconds{{entry="{entry}"}} '
+        f"{time.perf_counter() - run.start}",
+        f"# HELP {PREFIX}_last_run_timestamp_seconds Start of the last run",
+        f"# TYPE {PREFIX}_last_run_timestamp_seconds gauge",
+        f'{PREFIX}_last_run_timestamp_seconds{{entry="{entry}"}} '
+        f"{run.started_at}",
+    ])
+    return "\n".join(lines) + "\n"
+
+
+def write(run: Run, config_dir: Optional[Path] = None) -> None:
+    """Write the Prometheus textfile and append the run to the JSON lines"""
+    if config_dir is None:
+        config_dir = get_config_location()
+    prom_path = config_dir.joinpath(PROM_FILENAME.format(run.entry))
+    # the textfile collector may read at any time, so replace it atomically
+    atomic_write(prom_path, prometheus_text(run))
+    with config_dir.joinpath(JSONL_FILENAME).open('a') as f:
+        f.write(json.dumps(run.to_dict()) + "\n")
+    logger.debug(f"Wrote metrics to {prom_path}")
+
+
+@contextlib.contextmanager
+def recording(entry: str, enabled: bool = True) -> Iterator[Optional[Run]]:
+    """Record everything in the block as one run and write it out at the end
+
+    Does nothing if not `enabled`. A failure to write the metrics is logged
+    rather than raised, so it can't fail the run.
+    """
+    if not enabled:
+        yield None
+        return
+    run = enable(entry)
+    try:
+        yield run
+    finally:
+        disable()
+        try:
+            write(run)
+        except Exception:
+            logger.exception("Could not write metrics")
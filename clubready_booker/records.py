@@ -0,0 +1,160 @@
+"""The record of one class on the schedule, and its compact binary form.
+
+Class tables are serialized with msgpack. Each class is packed as a flat row in
+`FIELDS` order, with its datetimes as epoch seconds plus an index into a table
+of the timezones (and utc offsets) used, so loading a table rebuilds exactly
+the datetimes that were saved without parsing any strings.
+"""
+import datetime
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import msgpack
+import pytz
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+EPOCH = datetime.datetime(1970, 1, 1)
+# (timezone name, utc offset in seconds). Datetimes without a named timezone,
+# e.g. ones loaded from iso strings, are saved with a name of None
+Zone = Tuple[Optional[str], int]
+
+
+@dataclass
+class ClassRecord:
+    """One class on the schedule
+
+    `started` and `ended` are relative to when the record was made, see
+    `table_cache.refresh_class_status`. `texts`, every string in the class's
+    element, is only kept when debug logging is on.
+    """
+    __slots__ = (
+        'start_time', 'started', 'end_time', 'ended', 'class_name',
+        'duration', 'instructor', 'registered', 'class_size',
+        'spots_available', 'booking_id', 'texts'
+    )
+    start_time: Optional[datetime.datetime]
+    started: bool
+    end_time: Optional[datetime.datetime]
+    ended: bool
+    class_name: Optional[str]
+    duration: Optional[str]
+    instructor: Optional[str]
+    registered: Optional[int]
+    class_size: Optional[int]
+    spots_available: Optional[bool]
+    booking_id: Optional[str]
+    texts: Optional[List[str]]
+
+
+FIELDS = ClassRecord.__slots__
+START_IDX = FIELDS.index('start_time')
+END_IDX = FIELDS.index('end_time')
+
+
+def keep_texts() -> bool:
+    """Whether parsers should keep `texts`, only worth it when debugging"""
+    return logger.isEnabledFor(logging.DEBUG)
+
+
+def _zone(date_time: datetime.datetime) -> Zone:
+    tz = date_time.tzinfo
+    name = getattr(tz, 'zone', None) or getattr(tz, 'key', None)
+    return name, int(date_time.utcoffset().total_seconds())
+
+
+def _zone_decoder(zone: Zone) -> Callable[[float], datetime.datetime]:
+    """Rebuilds the datetimes saved with this zone from their epoch seconds
+
+    Every datetime in a zone has the same utc offset, and with pytz the same
+    tzinfo, so only the first one goes through the slow timezone lookup and
+    the rest are plain arithmetic. Schedules repeat the same start and end
+    times a lot, so each distinct time is only built once and then shared.
+    """
+    name, offset = zone
+    if name is None:
+        tz = datetime.timezone(datetime.timedelta(seconds=offset))
+    else:
+        tz = pytz.timezone(name)
+    local_epoch = EPOCH + datetime.timedelta(seconds=offset)
+    built: Dict[float, datetime.datetime] = {}
+    tzinfo = None
+
+    def decode(epoch: float) -> datetime.datetime:
+        nonlocal tzinfo
+        if (date_time := built.get(epoch)) is not None:
+            return date_time
+        if tzinfo is None:
+            date_time = datetime.datetime.fromtimestamp(epoch, tz)
+            tzinfo = date_time.tzinfo
+        else:
+            wall_time = local_epoch + datetime.timedelta(seconds=epoch)
+            date_time = wall_time.replace(tzinfo=tzinfo)
+        built[epoch] = date_time
+        return date_time
+    return decode
+
+
+def _epoch(date_time: datetime.datetime) -> Union[int, float]:
+    epoch = date_time.timestamp()
+    return int(epoch) if epoch.is_integer() else epoch
+
+
+def encode_records(
+        records: List[ClassRecord],
+        zones: Dict[Zone, int]
+) -> List[list]:
+    """Rows for `records`, adding any new timezones to `zones`
+
+    A time is packed as `[epoch, zone index]`. The records are not changed.
+    """
+    rows = []
+    for record in records:
+        row = [getattr(record, field) for field in FIELDS]
+        for idx in (START_IDX, END_IDX):
+            date_time = row[idx]
+            if date_time is not None:
+                zone = _zone(date_time)
+                zone_idx = zones.setdefault(zone, len(zones))
+                row[idx] = [_epoch(date_time), zone_idx]
+        rows.append(row)
+    return rows
+
+
+def decode_records(rows: List[list], zones: List[Zone]) -> List[ClassRecord]:
+    """Records for rows from `encode_records`, `zones` in index order"""
+    decoders = [_zone_decoder(tuple(zone)) for zone in zones]
+    records = []
+    for row in rows:
+        for idx in (START_IDX, END_IDX):
+            packed = row[idx]
+            if packed is not None:
+                row[idx] = decoders[packed[1]](packed[0])
+        records.append(ClassRecord(*row))
+    return records
+
+
+def pack(obj: Any) -> bytes:
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def unpack(data: bytes) -> Any:
+    return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+def dumps(class_table: List[ClassRecord]) -> bytes:
+    """Serialize a class table, without changing it"""
+    zones: Dict[Zone, int] = {}
+    rows = encode_records(class_table, zones)
+    return pack({'version': FORMAT_VERSION, 'zones': list(zones), 'rows': rows})
+
+
+def loads(data: bytes) -> List[ClassRecord]:
+    contents = unpack(data)
+    if contents.get('version') != FORMAT_VERSION:
+        raise ValueError(
+            f"Unknown class table format version {contents.get('version')}"
+        )
+    return decode_records(contents['rows'], contents['zones'])
@@ -0,0 +1,224 @@
+"""Book classes for several accounts, possibly at several clubs, in one run.
+
+Accounts are listed under `accounts` in config.yaml. Each entry only needs the
+values that differ from the top level config, typically `username`,
+`password` and `calendar_token` (each member's own Google Calendar token in the
+config dir), plus `url` and `base_url` for accounts at another club:
+
+    accounts:
+      - username: member1@example.com
+        password: ...
+        calendar_token: token_member1.json
+      - username: member2@example.com
+        password: ...
+        calendar_token: token_member2.json
+
+The class schedule is scraped once per club and shared by its accounts, and
+the calendar is fetched once per token file and shared by the accounts using
+it. Calendar fetches run at once, while open browsers (or http sessions) are
+capped at `max_browsers` across all accounts.
+
+    python -m clubready_booker.runner [--dry-run]
+"""
+import argparse
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from clubready_booker import (
+    booker, cal, metrics, setup_logging, snapshots, table_cache, util, waits,
+    webpage
+)
+from clubready_booker.records import ClassRecord
+
+logger = logging.getLogger(__name__)
+
+ClubKey = Tuple[str, str, str]
+
+
+def get_account_configs(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """One full config per account, the top level config if none are listed"""
+    accounts = config.get('accounts') or []
+    if not accounts:
+        return [config]
+    account_configs = []
+    for account in accounts:
+        account_config = {k: v for k, v in config.items() if k != 'accounts'}
+        account_config.update(account)
+        account_configs.append(account_config)
+    return account_configs
+
+
+def club_key(config: Dict[str, Any]) -> ClubKey:
+    """Accounts with the same key see the same class schedule"""
+    return config['url'], config['base_url'], config['timezone']
+
+
+def calendar_key(config: Dict[str, Any]) -> Tuple[str, int]:
+    """Accounts with the same key see the same calendar events"""
+    return (
+        config['calendar_token'] or cal.TOKEN_FILENAME,
+        int(config['bookable_range'])
+    )
+
+
+def club_cache_path(key: ClubKey):
+    club = hashlib.sha1("|".join(key).encode()).hexdigest()[:16]
+    name = Path(webpage.TABLE_CACHE_NAME)
+    return util.get_config_location().joinpath(
+        f"{name.stem}_{club}{name.suffix}"
+    )
+
+
+def scrape_club(
+        config: Dict[str, Any],
+        semaphore: threading.Semaphore,
+        lookahead: int = 0
+) -> List[ClassRecord]:
+    """Class table for a club, logging in as `config`'s account if needed"""
+    return booker.with_planning_driver(
+        config,
+        lambda open_driver: table_cache.get_class_table(
+            open_driver,
+            config['timezone'],
+            int(config['bookable_range']) + lookahead,
+            float(config['cache_ttl']),
+            path=club_cache_path(club_key(config)),
+            parser=config['parser'],
+            club=config['url']
+        ),
+        semaphore
+    )
+
+
+def run_account(
+        config: Dict[str, Any],
+        class_table: List[ClassRecord],
+        calendar_events: List[dict],
+        semaphore: threading.Semaphore,
+        dry_run: bool = False
+) -> List[Dict[str, Any]]:
+    """Match an account's events against its club's classes and book them"""
+    class_names = set(map(attrgetter('class_name'), class_table))
+    upcoming_events = cal.filter_summaries(calendar_events, class_names)
+    matched = booker.match_events(
+        upcoming_events, class_table, float(config['match_tolerance'])
+    )
+    if not matched:
+        return []
+    open_driver = booker.LazyDriver(config, semaphore)
+    try:
+        return webpage.book_classes(
+            open_driver(), webpage.by_scarcity(matched), dry_run
+        )
+    finally:
+        open_driver.close()
+
+
+def run(
+        config: Dict[str, Any],
+        dry_run: bool = False,
+        max_workers: int = None
+) -> List[Dict[str, Any]]:
+    """Book every account's matched classes
+
+    Returns:
+        a summary per account with its `username`, `club`, booking `results`
+        from `webpage.book_classes`, `error` if the account failed and
+        `seconds` it took from the start of the run
+    """
+    account_configs = get_account_configs(config)
+    max_browsers = int(config['max_browsers'])
+    semaphore = threading.BoundedSemaphore(max_browsers)
+    max_workers = max_workers or max(max_browsers, os.cpu_count() or 1)
+    clubs: Dict[ClubKey, Dict[str, Any]] = {}
+    for account_config in account_configs:
+        clubs.setdefault(club_key(account_config), account_config)
+    logger.info(
+        f"Running {len(account_configs)} accounts at {len(clubs)} clubs with "
+        f"at most {max_browsers} browsers"
+    )
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # accounts sharing a token file share its event store too, so each
+        # is only synced by one thread
+        calendars: Dict[Tuple[str, int], Dict[str, Any]] = {}
+        for account_config in account_configs:
+            calendars.setdefault(calendar_key(account_config), account_config)
+        calendar_futures = {
+            key: executor.submit(
+                booker.get_calendar_events, calendar_config, key[1]
+            )
+            for key, calendar_config in calendars.items()
+        }
+        table_futures = {
+            key: executor.submit(scrape_club, club_config, semaphore)
+            for key, club_config in clubs.items()
+        }
+
+        def run_one(idx: int) -> Dict[str, Any]:
+            account_config = account_configs[idx]
+            key = club_key(account_config)
+            summary = {
+                'username': account_config['username'],
+                'club': key[0],
+                'results': [],
+                'error': None
+            }
+            try:
+                summary['results'] = run_account(
+                    account_config,
+                    table_futures[key].result(),
+                    calendar_futures[calendar_key(account_config)].result(),
+                    semaphore,
+                    dry_run
+                )
+            except Exception as exc:
+                logger.exception(
+                    f"Encountered an exception for {account_config['username']}"
+                )
+                summary['error'] = repr(exc)
+            summary['seconds'] = time.perf_counter() - start
+            return summary
+
+        summaries = list(executor.map(run_one, range(len(account_configs))))
+
+    for summary in summaries:
+        statuses = [result['status'] for result in summary['results']]
+        logger.info(
+            f"{summary['username']} @ {summary['club']}: "
+            f"{len(statuses)} bookings attempted, "
+            f"{statuses.count(webpage.BOOKED)} booked, "
+            f"{statuses.count(webpage.WAITLISTED)} waitlisted, "
+            f"{statuses.count(webpage.FAILED)} failed"
+            f"{', error: ' + summary['error'] if summary['error'] else ''} "
+            f"({summary['seconds']:.1f}s)"
+        )
+    return summaries
+
+
+def main(dry_run: bool = False) -> None:
+    config = util.get_config()
+    waits.configure(config['wait_budgets'])
+    try:
+        with metrics.recording("runner", util.to_bool(config['metrics'])), \
+                snapshots.recording(util.to_bool(config['snapshots'])):
+            run(config, dry_run)
+    except Exception as exc:
+        logger.exception("Encountered an exception")
+        raise exc
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    setup_logging()
+    main(dry_run=args.dry_run)
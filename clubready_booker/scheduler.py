@@ -0,0 +1,326 @@
+"""Long running scheduler that books classes the moment they open.
+
+Instead of booking once a night from cron, the scheduler works out when the
+booking window of every matched class opens, logs in and loads the class's
+schedule week shortly before, refreshing the classes from it, and books them
+as close as it can to the opening instant. Classes whose book button only
+shows once booking opens are read again right after the opening. Pending
+classes wait in a heap ordered on monotonic clock deadlines, so wall clock
+adjustments while waiting don't move them.
+
+    python -m clubready_booker.scheduler [--dry-run]
+"""
+import argparse
+import datetime
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple, TYPE_CHECKING
+
+import pytz
+
+from clubready_booker import (
+    booker, metrics, setup_logging, snapshots, util, waits, webpage
+)
+from clubready_booker.http_session import ClubReadySession
+from clubready_booker.records import ClassRecord
+
+if TYPE_CHECKING:
+    from selenium.webdriver.remote.webdriver import WebDriver
+
+logger = logging.getLogger(__name__)
+
+# seconds before a window opens to log in and load the classes page
+PREPARE_LEAD = 60
+# seconds between refreshes of the calendar and class table
+REPLAN_INTERVAL = 900
+# the last stretch before a deadline is busy waited instead of slept
+SPIN_WINDOW = 0.002
+# times to read the schedule after an opening for classes without a booking id
+OPEN_RETRIES = 5
+# seconds between those reads
+OPEN_RETRY_DELAY = 0.5
+
+
+def booking_opens_at(
+        class_start: datetime.datetime,
+        bookable_range: int,
+        timezone: str
+) -> datetime.datetime:
+    """When a class can first be booked
+
+    A bookable range of 2 means that on Jan 1 classes on Jan 2 and Jan 3 can
+    be booked, so a class opens at midnight, club time, `bookable_range` days
+    before the day it is on.
+    """
+    tz = pytz.timezone(timezone)
+    class_day = class_start.astimezone(tz).date()
+    open_day = class_day - datetime.timedelta(days=bookable_range)
+    return tz.localize(datetime.datetime.combine(open_day, datetime.time(0)))
+
+
+def monotonic_deadline(wall_time: datetime.datetime) -> float:
+    """`time.monotonic()` value at which it will be `wall_time`"""
+    return time.monotonic() + (wall_time.timestamp() - time.time())
+
+
+def sleep_until(deadline: float, spin_window: float = SPIN_WINDOW) -> None:
+    """Sleep until a monotonic deadline, busy waiting the last `spin_window`"""
+    while (remaining := deadline - time.monotonic()) > spin_window:
+        time.sleep(remaining - spin_window)
+    while time.monotonic() < deadline:
+        pass
+
+
+class BookingScheduler:
+    """Timer heap of classes waiting for their booking window to open
+
+    Args:
+        config: from `util.get_config`
+        dry_run: go through booking without confirming it
+        prepare_lead: seconds before an opening to log in and load the page
+        replan_interval: seconds between refreshes of the matched classes
+    """
+
+    def __init__(
+            self,
+            config: Dict[str, Any],
+            dry_run: bool = False,
+            prepare_lead: float = PREPARE_LEAD,
+            replan_interval: float = REPLAN_INTERVAL
+    ):
+        self.config = config
+        self.dry_run = dry_run
+        self.prepare_lead = prepare_lead
+        self.replan_interval = replan_interval
+        self.open_driver = booker.LazyDriver(config)
+        self.heap: List[Tuple[float, int, datetime.datetime, ClassRecord]] = []
+        self.counter = itertools.count()
+        self.scheduled: Set[Tuple[str, datetime.datetime]] = set()
+        self.next_plan = time.monotonic()
+        self.record_metrics = util.to_bool(config['metrics'])
+        self.record_snapshots = util.to_bool(config['snapshots'])
+
+    def plan(self) -> None:
+        """Match calendar events to classes and schedule any new ones"""
+        bookable_range = int(self.config['bookable_range'])
+        matched = booker.find_matches(self.config, lookahead=1)
+        added = 0
+        for class_record in matched:
+            key = (class_record.class_name, class_record.start_time)
+            if key in self.scheduled or class_record.started:
+                continue
+            opens_at = booking_opens_at(
+                class_record.start_time, bookable_range,
+                self.config['timezone']
+            )
+            heapq.heappush(self.heap, (
+                monotonic_deadline(opens_at), next(self.counter), opens_at,
+                class_record
+            ))
+            self.scheduled.add(key)
+            added += 1
+            logger.info(
+                f"Scheduled {class_record.class_name} at "
+                f"{class_record.start_time.isoformat()}, booking opens "
+                f"{opens_at.isoformat()}"
+                f"{'' if class_record.booking_id else ', no booking id yet'}"
+            )
+        logger.info(f"Planned {added} new bookings, {len(self.heap)} pending")
+        self.next_plan = time.monotonic() + self.replan_interval
+
+    def pop_due(self) -> Tuple[datetime.datetime, List[ClassRecord]]:
+        """All classes that open at the earliest pending opening"""
+        _, _, opens_at, class_record = heapq.heappop(self.heap)
+        due = [class_record]
+        while self.heap and self.heap[0][2] == opens_at:
+            due.append(heapq.heappop(self.heap)[3])
+        return opens_at, due
+
+    def refresh(
+            self,
+            driver: "WebDriver",
+            due: List[ClassRecord],
+            reload: bool = False
+    ) -> List[ClassRecord]:
+        """The due classes as they are on the site now
+
+        Each due class's week is loaded, again with `reload`, and parsed, and
+        the classes are replaced by their fresh copies, found by name and
+        start time, for current booking ids and spots.
+        """
+        parse_columns = webpage.get_column_parser(self.config['parser'])
+        fresh: Dict[Tuple[str, datetime.datetime], ClassRecord] = {}
+        for week in webpage.by_week(due):
+            if isinstance(driver, ClubReadySession):
+                source = driver.fetch(webpage.week_url(week, driver.base_url))
+            else:
+                webpage.get_classes_page(driver, week, reload)
+                source = driver.page_source
+            _, columns = parse_columns(source, self.config['timezone'])
+            for column in columns.values():
+                for class_record in column['classes']:
+                    key = (class_record.class_name, class_record.start_time)
+                    fresh[key] = class_record
+        refreshed = []
+        for class_record in due:
+            current = fresh.get(
+                (class_record.class_name, class_record.start_time)
+            )
+            if current is None:
+                logger.warning(
+                    f"{class_record.class_name} at "
+                    f"{class_record.start_time.isoformat()} is no longer on "
+                    f"the schedule, booking it as planned"
+                )
+                current = class_record
+            elif not current.booking_id:
+                current.booking_id = class_record.booking_id
+            refreshed.append(current)
+        return refreshed
+
+    def await_booking_ids(
+            self,
+            driver: "WebDriver",
+            due: List[ClassRecord]
+    ) -> List[ClassRecord]:
+        """The due classes that can be booked, once booking has opened
+
+        Weeks with classes that have no booking id yet are read again, up to
+        `OPEN_RETRIES` times, since their book buttons may only show once
+        booking opens. Classes that still have none are skipped.
+        """
+        ready = [
+            class_record for class_record in due if class_record.booking_id
+        ]
+        waiting = [
+            class_record for class_record in due if not class_record.booking_id
+        ]
+        for attempt in range(OPEN_RETRIES):
+            if not waiting:
+                break
+            if attempt:
+                time.sleep(OPEN_RETRY_DELAY)
+            refreshed = self.refresh(driver, waiting, reload=True)
+            ready.extend(
+                class_record for class_record in refreshed
+                if class_record.booking_id
+            )
+            waiting = [
+                class_record for class_record in refreshed
+                if not class_record.booking_id
+            ]
+        for class_record in waiting:
+            logger.warning(
+                f"Skipping {class_record.class_name} at "
+                f"{class_record.start_time.isoformat()}, it has no booking id "
+                f"after booking opened"
+            )
+        return ready
+
+    def fire(self, opens_at: datetime.datetime, due: List[ClassRecord]):
+        """Warm up the browser, refresh the due classes, wait for the window
+        to open and book
+
+        With `booking_workers` over 1 and several classes due, a pool of that
+        many logged in browsers is warmed up and books them in parallel.
+        """
+        pool = None
+        workers = min(int(self.config['booking_workers']), len(due))
+        try:
+            if workers > 1:
+                pool = booker.BookingPool(
+                    self.config, workers, self.open_driver
+                )
+                pool.open()
+                driver = pool.ready[0]()
+            else:
+                driver = self.open_driver()
+            due = self.refresh(driver, due)
+            if pool is None:
+                # be on the first week booked from when the window opens
+                first_week = next(iter(
+                    webpage.by_week(webpage.by_scarcity(due))
+                ))
+                webpage.get_classes_page(driver, first_week)
+            # recompute from the wall clock now that the opening is close
+            deadline = monotonic_deadline(opens_at)
+            if deadline > time.monotonic():
+                logger.info(
+                    f"Ready {deadline - time.monotonic():.3f}s before booking "
+                    f"opens for {len(due)} classes"
+                )
+                sleep_until(deadline)
+            due = self.await_booking_ids(driver, due)
+            if not due:
+                logger.warning("None of the due classes can be booked")
+                return
+            if pool is not None:
+                results = pool.book(due, self.dry_run)
+            else:
+                results = webpage.book_classes(
+                    driver, webpage.by_scarcity(due), self.dry_run
+                )
+        finally:
+            if pool is not None:
+                pool.close()
+            self.open_driver.close()
+        for result in results:
+            offset_ms = (result['started_at'] - opens_at.timestamp()) * 1000
+            logger.info(
+                f"Booking attempt for {result['class_name']} at "
+                f"{result['start_time'].isoformat()} fired "
+                f"{offset_ms:+.1f}ms from window opening, took "
+                f"{result['seconds'] * 1000:.0f}ms: {result['status']}"
+            )
+
+    def run_once(self) -> None:
+        """Wait for whatever comes next, a replan or an opening, and do it"""
+        now = time.monotonic()
+        next_prepare: Optional[float] = None
+        if self.heap:
+            next_prepare = self.heap[0][0] - self.prepare_lead
+        if next_prepare is None or self.next_plan < next_prepare:
+            time.sleep(max(0.0, self.next_plan - now))
+            # each plan and each booking is recorded as a run of its own
+            with metrics.recording("scheduler", self.record_metrics), \
+                    snapshots.recording(self.record_snapshots):
+                self.plan()
+            return
+        time.sleep(max(0.0, next_prepare - now))
+        with metrics.recording("scheduler", self.record_metrics):
+            self.fire(*self.pop_due())
+
+    def run(self) -> None:
+        try:
+            while True:
+                try:
+                    self.run_once()
+                except Exception:
+                    logger.exception("Scheduler step failed, carrying on")
+                    self.open_driver.close()
+                    time.sleep(1)
+        finally:
+            self.open_driver.close()
+
+
+def main(dry_run: bool = False) -> None:
+    config = util.get_config()
+    waits.configure(config['wait_budgets'])
+    scheduler = BookingScheduler(config, dry_run)
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        logger.info("Scheduler stopped")
+    except Exception as exc:
+        logger.exception("Encountered an exception")
+        raise exc
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    setup_logging()
+    main(dry_run=args.dry_run)
@@ -0,0 +1,110 @@
+"""Saved ClubReady sessions, so most runs can skip logging in.
+
+Session cookies are kept in the config dir, one file per account, encrypted
+with a key that is generated on first use and only readable by the owner.
+The resolved chromedriver path is cached in the config dir as well, so that
+starting a driver doesn't have to ask webdriver_manager every time.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from clubready_booker.util import atomic_write, get_config_location
+
+logger = logging.getLogger(__name__)
+
+KEY_FILENAME = "session.key"
+SESSION_FILENAME = "session_{}.enc"
+DRIVER_PATH_FILENAME = "chromedriver_path"
+
+
+def _config_dir(config_dir: Optional[Path]) -> Path:
+    return config_dir if config_dir is not None else get_config_location()
+
+
+def get_key(config_dir: Optional[Path] = None) -> bytes:
+    from cryptography.fernet import Fernet
+
+    key_path = _config_dir(config_dir).joinpath(KEY_FILENAME)
+    if key_path.exists():
+        return key_path.read_bytes()
+    key = Fernet.generate_key()
+    # a concurrent first run may get there first, then its key is the key
+    if not atomic_write(key_path, key, 0o600, exclusive=True):
+        return key_path.read_bytes()
+    return key
+
+
+def session_path(
+        username: str,
+        url: str,
+        config_dir: Optional[Path] = None
+) -> Path:
+    account = hashlib.sha1(f"{username}|{url}".encode()).hexdigest()[:16]
+    return _config_dir(config_dir).joinpath(SESSION_FILENAME.format(account))
+
+
+def save_cookies(
+        cookies: List[Dict[str, Any]],
+        username: str,
+        url: str,
+        config_dir: Optional[Path] = None
+) -> None:
+    """Encrypt and save the cookies of a logged in session"""
+    from cryptography.fernet import Fernet
+
+    contents = json.dumps({'saved_at': time.time(), 'cookies': cookies})
+    token = Fernet(get_key(config_dir)).encrypt(contents.encode())
+    path = session_path(username, url, config_dir)
+    atomic_write(path, token, 0o600)
+    logger.debug(f"Saved {len(cookies)} session cookies to {path}")
+
+
+def load_cookies(
+        username: str,
+        url: str,
+        config_dir: Optional[Path] = None
+) -> Optional[List[Dict[str, Any]]]:
+    """Cookies saved for this account, None if there are none or they can't
+    be decrypted"""
+    from cryptography.fernet import Fernet, InvalidToken
+
+    path = session_path(username, url, config_dir)
+    if not path.exists():
+        return None
+    try:
+        contents = Fernet(get_key(config_dir)).decrypt(path.read_bytes())
+    except InvalidToken:
+        logger.warning(f"Could not decrypt saved session {path}, ignoring it")
+        return None
+    return json.loads(contents)['cookies']
+
+
+def forget_session(
+        username: str,
+        url: str,
+        config_dir: Optional[Path] = None
+) -> None:
+    session_path(username, url, config_dir).unlink(missing_ok=True)
+
+
+def get_chromedriver_path(
+        config_dir: Optional[Path] = None,
+        refresh: bool = False
+) -> str:
+    """Path of chromedriver, only resolved with webdriver_manager when the
+    cached path is missing or no longer exists, or to `refresh` it, e.g. once
+    Chrome has updated past the cached driver"""
+    cache_path = _config_dir(config_dir).joinpath(DRIVER_PATH_FILENAME)
+    if not refresh and cache_path.exists():
+        driver_path = cache_path.read_text().strip()
+        if driver_path and os.path.exists(driver_path):
+            return driver_path
+    from webdriver_manager.chrome import ChromeDriverManager
+    driver_path = ChromeDriverManager().install()
+    atomic_write(cache_path, driver_path)
+    return driver_path
@@ -0,0 +1,245 @@
+"""History of every class schedule scraped, for tuning when to book.
+
+Each scrape of the site adds a snapshot of every class in it: name, start,
+instructor, registered and class size, and when it was scraped. Snapshots are
+kept in an append-only SQLite database in the config dir, `SNAPSHOT_FILENAME`.
+
+Like `metrics`, scrapes are only kept inside a `recording` block, which the
+entry points open unless `snapshots` is turned off in the config. While
+recording, scrapes are only buffered, and the whole run is written at the end
+in one transaction, so a run pays for one small write.
+
+How a class fills up can then be read back quickly over years of data, e.g.
+from the command line:
+
+    python -m clubready_booker.snapshots "Boxing All Levels" --weekday tue
+"""
+import argparse
+import contextlib
+import datetime
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from clubready_booker.records import ClassRecord
+from clubready_booker.util import default_config_vals, get_config_location
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILENAME = "class_snapshots.sqlite3"
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+# a class is one scheduled occurrence, weekday and start_minute are club time
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS classes (
+    id INTEGER PRIMARY KEY,
+    club TEXT NOT NULL,
+    class_name TEXT NOT NULL,
+    start_time REAL NOT NULL,
+    weekday INTEGER NOT NULL,
+    start_minute INTEGER NOT NULL,
+    instructor TEXT,
+    UNIQUE (club, class_name, start_time)
+);
+CREATE INDEX IF NOT EXISTS classes_by_slot
+    ON classes (class_name, weekday, start_minute, start_time);
+CREATE TABLE IF NOT EXISTS observations (
+    class_id INTEGER NOT NULL REFERENCES classes (id),
+    scraped_at REAL NOT NULL,
+    registered INTEGER,
+    class_size INTEGER,
+    PRIMARY KEY (class_id, scraped_at)
+) WITHOUT ROWID;
+"""
+
+# (club, scraped_at, classes) waiting to be written
+_pending: Optional[List[Tuple[str, float, List[ClassRecord]]]] = None
+_lock = threading.Lock()
+
+
+def connect(path: Optional[Path] = None) -> sqlite3.Connection:
+    if path is None:
+        path = get_config_location().joinpath(SNAPSHOT_FILENAME)
+    # several runs can share the store, a busy one is waited on
+    conn = sqlite3.connect(str(path), timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def write(
+        conn: sqlite3.Connection,
+        snapshots: List[Tuple[str, float, List[ClassRecord]]]
+) -> int:
+    """Append snapshots in a single transaction, returning the rows added"""
+    class_rows = []
+    observation_rows = []
+    for club, scraped_at, class_table in snapshots:
+        for record in class_table:
+            if record.start_time is None or record.class_name is None:
+                continue
+            start = record.start_time
+            class_key = (club, record.class_name, start.timestamp())
+            class_rows.append((
+                *class_key, start.weekday(), start.hour * 60 + start.minute,
+                record.instructor
+            ))
+            observation_rows.append((
+                *class_key, scraped_at, record.registered, record.class_size
+            ))
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO classes (club, class_name, start_time, "
+            "weekday, start_minute, instructor) VALUES (?, ?, ?, ?, ?, ?)",
+            class_rows
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO observations "
+            "SELECT id, ?, ?, ? FROM classes "
+            "WHERE club = ? AND class_name = ? AND start_time = ?",
+            [row[3:] + row[:3] for row in observation_rows]
+        )
+    return len(observation_rows)
+
+
+def add(club: str, class_table: List[ClassRecord]) -> None:
+    """Buffer a freshly scraped class table, if recording"""
+    with _lock:
+        if _pending is not None:
+            _pending.append((club, time.time(), list(class_table)))
+
+
+@contextlib.contextmanager
+def recording(
+        enabled: bool = True,
+        path: Optional[Path] = None
+) -> Iterator[None]:
+    """Buffer every scrape in the block and write them out at the end
+
+    Does nothing if not `enabled`. A failure to write is logged rather than
+    raised, so it can't fail the run.
+    """
+    global _pending
+    if not enabled:
+        yield
+        return
+    with _lock:
+        _pending = []
+    try:
+        yield
+    finally:
+        with _lock:
+            pending, _pending = _pending, None
+        if pending:
+            try:
+                conn = connect(path)
+                try:
+                    n_rows = write(conn, pending)
+                finally:
+                    conn.close()
+                logger.debug(f"Saved {n_rows} class snapshots")
+            except Exception:
+                logger.exception("Could not save class snapshots")
+
+
+def fill_history(
+        conn: sqlite3.Connection,
+        class_name: str,
+        weekday: Optional[int] = None,
+        since: Optional[datetime.datetime] = None
+) -> Dict[Tuple[str, float], List[Tuple[float, int, int]]]:
+    """Every observation of a class, optionally only on one weekday
+
+    Returns:
+        (club, start epoch seconds) of each occurrence to its observations,
+        (scraped_at, registered, class_size) in the order they were scraped
+    """
+    query = (
+        "SELECT c.club, c.start_time, o.scraped_at, o.registered, "
+        "o.class_size FROM classes c JOIN observations o ON o.class_id = c.id "
+        "WHERE c.class_name = ?"
+    )
+    params: List[Any] = [class_name]
+    if weekday is not None:
+        query += " AND c.weekday = ?"
+        params.append(weekday)
+    if since is not None:
+        query += " AND c.start_time >= ?"
+        params.append(since.timestamp())
+    query += " ORDER BY c.start_time, o.scraped_at"
+    history: Dict[Tuple[str, float], List[Tuple[float, int, int]]] = {}
+    for club, start, scraped_at, registered, class_size in conn.execute(
+            query, params
+    ):
+        history.setdefault((club, start), []).append(
+            (scraped_at, registered, class_size)
+        )
+    return history
+
+
+def time_to_fill(
+        observations: List[Tuple[float, int, int]],
+        start: float
+) -> Optional[float]:
+    """Hours before the class started that it was first seen full, None if it
+    never was"""
+    for scraped_at, registered, class_size in observations:
+        if registered is not None and class_size and registered >= class_size:
+            return (start - scraped_at) / 3600
+    return None
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="How early a class fills up, from the snapshot history"
+    )
+    parser.add_argument("class_name")
+    parser.add_argument("--weekday", choices=WEEKDAYS)
+    parser.add_argument("--days", type=int, help="only the last this many")
+    parser.add_argument("--path", type=Path, help="snapshot database")
+    parser.add_argument(
+        "--timezone", default=default_config_vals['timezone'],
+        help="the club's, to show class times in"
+    )
+    args = parser.parse_args(argv)
+    import pytz
+
+    tz = pytz.timezone(args.timezone)
+    since = None
+    if args.days:
+        since = datetime.datetime.now(datetime.timezone.utc) - \
+            datetime.timedelta(days=args.days)
+    weekday = WEEKDAYS.index(args.weekday) if args.weekday else None
+    conn = connect(args.path)
+    try:
+        history = fill_history(conn, args.class_name, weekday, since)
+    finally:
+        conn.close()
+    filled = []
+    for (club, start), observations in history.items():
+        hours = time_to_fill(observations, start)
+        registered, class_size = observations[-1][1:]
+        start_str = datetime.datetime.fromtimestamp(start, tz).strftime(
+            "%a %Y-%m-%d %H:%M"
+        )
+        full_str = f"full {hours:.1f}h before" if hours is not None \
+            else "never seen full"
+        print(
+            f"{start_str}  {registered}/{class_size}  {full_str}  "
+            f"({len(observations)} snapshots)"
+        )
+        if hours is not None:
+            filled.append(hours)
+    if filled:
+        filled.sort()
+        print(
+            f"{len(filled)} of {len(history)} filled, median "
+            f"{filled[len(filled) // 2]:.1f}h before the class"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""Time limited, per-week cache of the class table.
+
+The cache file lives in the config dir and holds one entry per schedule week,
+keyed on the first date of the page's own week range. Each week stores when it
+was fetched and every column of the schedule, by its date, with the
+fingerprint of its html, so a refresh only parses the columns that changed.
+Classes are stored in the packed form of `records`.
+
+Classes are read back by column date, so it doesn't matter which day the
+club's weeks start on.
+"""
+import logging
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, TYPE_CHECKING
+
+import pytz
+
+from clubready_booker import metrics, records, snapshots, webpage
+from clubready_booker.records import ClassRecord
+from clubready_booker.util import atomic_write, get_config_location
+
+if TYPE_CHECKING:
+    from selenium.webdriver.remote.webdriver import WebDriver
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 2
+
+
+def refresh_class_status(record: ClassRecord, now: datetime) -> ClassRecord:
+    """Recompute the time dependent fields of a cached class"""
+    class_start, class_end = record.start_time, record.end_time
+    record.started = class_start < now if class_start else True
+    record.ended = class_end < now if class_end else True
+    return record
+
+
+class ClassTableCache:
+    """Cached schedule weeks, see module docstring
+
+    Args:
+        path: location of the cache file
+        ttl: seconds a week stays fresh after it was fetched, 0 never caches
+    """
+
+    def __init__(self, path: Path, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self.weeks: Dict[str, Dict[str, Any]] = {}
+
+    @classmethod
+    def load(cls, path: Path, ttl: float) -> "ClassTableCache":
+        cache = cls(path, ttl)
+        if not path.exists():
+            return cache
+        try:
+            contents = records.unpack(path.read_bytes())
+        except (OSError, ValueError):
+            logger.warning(f"Ignoring unreadable class table cache {path}")
+            return cache
+        if not isinstance(contents, dict) or \
+                contents.get('version') != CACHE_VERSION:
+            logger.info(f"Ignoring class table cache in an old format: {path}")
+            return cache
+        zones = contents['zones']
+        for week, entry in contents['weeks'].items():
+            for column in entry['columns'].values():
+                column['classes'] = records.decode_records(
+                    column['classes'], zones
+                )
+            cache.weeks[week] = entry
+        return cache
+
+    def save(self) -> None:
+        zones = {}
+        weeks = {
+            week: {
+                'fetched_at': entry['fetched_at'],
+                'columns': {
+                    column_date: {
+                        'fingerprint': column['fingerprint'],
+                        'classes': records.encode_records(
+                            column['classes'], zones
+                        )
+                    }
+                    for column_date, column in entry['columns'].items()
+                }
+            }
+            for week, entry in self.weeks.items()
+        }
+        atomic_write(self.path, records.pack({
+            'version': CACHE_VERSION,
+            'zones': list(zones),
+            'weeks': weeks
+        }))
+
+    def fresh_dates(self) -> Set[str]:
+        """Iso dates of every column in a week that is still fresh"""
+        now = time.time()
+        return {
+            column_date
+            for entry in self.weeks.values()
+            if now - entry['fetched_at'] < self.ttl
+            for column_date in entry['columns']
+        }
+
+    def stale_dates(self, first: date, last: date) -> List[date]:
+        """Dates from first to last, inclusive, without a fresh column"""
+        fresh = self.fresh_dates()
+        n_days = (last - first).days + 1
+        return [
+            day for day in (first + timedelta(days=i) for i in range(n_days))
+            if day.isoformat() not in fresh
+        ]
+
+    def columns(self, week: date) -> Dict[str, Dict[str, Any]]:
+        entry = self.weeks.get(week.isoformat())
+        return entry['columns'] if entry is not None else {}
+
+    def put_week(self, week: date, columns: Dict[str, Dict[str, Any]]) -> None:
+        self.weeks[week.isoformat()] = {
+            'fetched_at': time.time(),
+            'columns': columns
+        }
+
+    def prune(self, oldest: date) -> None:
+        """Forget weeks that end before oldest"""
+        for week, entry in list(self.weeks.items()):
+            if max(entry['columns'], default=week) < oldest.isoformat():
+                del self.weeks[week]
+
+    def class_table(
+            self,
+            first: date,
+            last: date,
+            timezone: str
+    ) -> List[ClassRecord]:
+        """Classes on the days from first to last, inclusive"""
+        now = datetime.now(pytz.timezone(timezone))
+        first_key, last_key = first.isoformat(), last.isoformat()
+        class_table = []
+        for week in sorted(self.weeks):
+            for column_date, column in sorted(
+                    self.weeks[week]['columns'].items()
+            ):
+                if first_key <= column_date <= last_key:
+                    class_table.extend(column['classes'])
+        class_table = webpage.merge_class_tables([class_table])
+        return [refresh_class_status(record, now) for record in class_table]
+
+
+@metrics.timed("class_table")
+def get_class_table(
+        open_driver: Callable[[], "WebDriver"],
+        timezone: str,
+        bookable_range: int,
+        ttl: float,
+        path: Optional[Path] = None,
+        parser: str = "fast",
+        club: str = ""
+) -> List[ClassRecord]:
+    """Class table for the bookable range, scraping only if the cache is stale
+
+    Args:
+        open_driver: called for a logged in driver, only if the site has to be
+            scraped
+        timezone: timezone for the class times in the class schedule
+        bookable_range: how many days out classes can be booked
+        ttl: seconds a cached week stays fresh
+        path: cache file, defaults to `webpage.TABLE_CACHE_NAME` in the config
+            dir
+        parser: which schedule parser to use, see `webpage.build_class_table`
+        club: which club the schedule is for, e.g. its login url, to tell the
+            clubs apart in `snapshots`
+    """
+    if path is None:
+        path = get_config_location().joinpath(webpage.TABLE_CACHE_NAME)
+    cache = ClassTableCache.load(path, ttl)
+    today = datetime.now(pytz.timezone(timezone)).date()
+    last_day = today + timedelta(days=bookable_range)
+    stale = cache.stale_dates(today, last_day)
+    if not stale:
+        logger.info(f"Using cached class table from {str(path)}")
+        return cache.class_table(today, last_day, timezone)
+
+    logger.info(
+        f"Class table cache is stale for "
+        f"{', '.join(map(date.isoformat, stale))}, refreshing"
+    )
+    scraped = webpage.build_class_table(
+        open_driver(), timezone, bookable_range, cache, parser
+    )
+    snapshots.add(club, scraped)
+    cache.prune(today)
+    if ttl > 0:
+        cache.save()
+    class_table = cache.class_table(today, last_day, timezone)
+    if scraped and not class_table:
+        logger.warning(
+            f"Scraped {len(scraped)} classes but none are from {today} to "
+            f"{last_day}"
+        )
+    return class_table
@@ -1,5 +1,6 @@
 """Functions for managing secrets"""
 import os
+import tempfile
 from pathlib import Path
 import yaml
 import logging
@@ -29,9 +30,25 @@ default_config_vals = {
     'username': None,
     'password': None,
     'url': None,
+    'base_url': "https://app.clubready.com/clients",
+    'backend': "selenium",
+    'browser_profile': "lean",
+    'plan_backend': "http",
     'bookable_range': 2,
     'max_results': 100,
     'timezone': 'America/New_York',
+    'cache_ttl': 900,
+    'parser': "fast",
+    'match_tolerance': 0,
+    'calendar_sync': True,
+    'reuse_session': True,
+    'calendar_token': None,
+    'accounts': None,
+    'max_browsers': 2,
+    'booking_workers': 1,
+    'metrics': False,
+    'snapshots': True,
+    'wait_budgets': None,
     'config_dir': None
 }
 
@@ -63,15 +80,64 @@ def get_config_location():
 
 
 def get_var_from_hierarchy(config, var_name):
+    """Env var, else config file value, else default
+
+    Keys left blank in the config file load as None and count as not given,
+    so a config copied from the template gets the defaults.
+    """
     env_val = env_vars.get(var_name, NotSpecified())
     if not isinstance(env_val, NotSpecified):
         return env_val
-    config_val = config.get(var_name, NotSpecified())
-    if not isinstance(config_val, NotSpecified):
+    config_val = config.get(var_name)
+    if config_val is not None:
         return config_val
     return default_config_vals[var_name]
 
 
+def atomic_write(
+        path: Path,
+        data: Union[bytes, str],
+        mode: int = 0o644,
+        exclusive: bool = False
+) -> bool:
+    """Write a file so readers only ever see the old or the new contents
+
+    The data goes to a uniquely named temp file next to `path`, which then
+    replaces it, so concurrent writers can't clobber each other's temp file.
+    With `exclusive`, `path` is only created if it doesn't exist yet.
+
+    Returns:
+        False if `exclusive` and `path` already existed, otherwise True
+    """
+    if isinstance(data, str):
+        data = data.encode()
+    with tempfile.NamedTemporaryFile(
+            dir=path.parent, prefix=path.name + ".", suffix=".tmp",
+            delete=False
+    ) as f:
+        f.write(data)
+    tmp_path = Path(f.name)
+    try:
+        os.chmod(tmp_path, mode)
+        if not exclusive:
+            os.replace(tmp_path, path)
+            return True
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            return False
+        return True
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def to_bool(value: Union[bool, str, None]) -> bool:
+    """Config values from env vars are always strings"""
+    if isinstance(value, str):
+        return value.strip().lower() not in ("", "0", "false", "no", "off")
+    return bool(value)
+
+
 def get_config():
     config_dir = get_config_location()
     config_path = config_dir.joinpath(FILE_NAME)
@@ -84,7 +150,8 @@ def get_config():
         parsed_config = {}
     else:
         with config_path.open('r') as f:
-            parsed_config: Dict[str, Union[int, str]] = yaml.safe_load(f)
+            parsed_config: Dict[str, Union[int, str]] = \
+                yaml.safe_load(f) or {}
 
     config = {}
     for key in default_config_vals:
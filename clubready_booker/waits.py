@@ -0,0 +1,141 @@
+"""Waiting for the ClubReady site to be ready, instead of sleeping.
+
+Every wait polls for a specific readiness signal, e.g. the schedule's
+`#weekrange` and `#scheduleRow` being on the page, and gives up once its
+phase's budget runs out. A page that is already ready costs one check, so
+runs move on as soon as the site is, and the slowest a phase can be is its
+budget.
+
+Each wait is recorded as a `wait_<phase>` span (see `metrics`), and waits that
+run out of budget are counted as `wait_<phase>_timeouts`.
+"""
+import logging
+import time
+from typing import Any, Callable, Dict, Optional, TypeVar, Union, TYPE_CHECKING
+
+from selenium.common.exceptions import TimeoutException
+
+from clubready_booker import metrics
+
+if TYPE_CHECKING:
+    from selenium.webdriver.remote.webdriver import WebDriver
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+LOGIN = "login"
+PAGE = "page"
+SCHEDULE = "schedule"
+POPUP = "popup"
+# seconds each phase may wait before giving up
+DEFAULT_BUDGETS = {LOGIN: 15.0, PAGE: 15.0, SCHEDULE: 15.0, POPUP: 10.0}
+POLL_INTERVAL = 0.05
+
+_budgets: Dict[str, float] = dict(DEFAULT_BUDGETS)
+
+
+def parse_budgets(
+        budgets: Union[Dict[str, Any], str, None]
+) -> Dict[str, float]:
+    """Budgets from the config, as a mapping or, from an env var, a string
+    like "login=20,schedule=10". Phases not given keep their default"""
+    parsed = dict(DEFAULT_BUDGETS)
+    if not budgets:
+        return parsed
+    if isinstance(budgets, str):
+        budgets = dict(
+            item.split("=", 1) for item in budgets.split(",") if item.strip()
+        )
+    for phase, seconds in budgets.items():
+        phase = phase.strip()
+        if phase not in DEFAULT_BUDGETS:
+            raise ValueError(
+                f"Unknown wait phase {phase}, expected one of "
+                f"{tuple(DEFAULT_BUDGETS)}"
+            )
+        parsed[phase] = float(seconds)
+    return parsed
+
+
+def configure(budgets: Union[Dict[str, Any], str, None]) -> None:
+    """Set the budgets used by every wait, from `wait_budgets` in the config"""
+    global _budgets
+    _budgets = parse_budgets(budgets)
+
+
+def budget(phase: str) -> float:
+    return _budgets[phase]
+
+
+def wait_until(
+        driver: "WebDriver",
+        ready: Callable[["WebDriver"], T],
+        phase: str,
+        what: str,
+        timeout: Optional[float] = None
+) -> T:
+    """Poll until `ready` returns something truthy, and return it
+
+    Args:
+        driver: selenium driver
+        ready: readiness check, like selenium's expected conditions
+        phase: which budget to use, and the name the wait is recorded under
+        what: what is being waited for, for the log
+        timeout: seconds to wait instead of the phase's budget
+    Raises:
+        TimeoutException: if the budget runs out first. The driver is left
+            open, closing it is up to the caller
+    """
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    timeout = budget(phase) if timeout is None else timeout
+    start = time.perf_counter()
+    try:
+        with metrics.span(f"wait_{phase}"):
+            result = WebDriverWait(
+                driver, timeout, poll_frequency=POLL_INTERVAL
+            ).until(ready)
+    except TimeoutException as exc:
+        metrics.count(f"wait_{phase}_timeouts")
+        logger.error(f"Timed out after {timeout}s waiting for {what}")
+        raise exc
+    logger.debug(
+        "Waited %.0fms for %s", (time.perf_counter() - start) * 1000, what
+    )
+    return result
+
+
+def all_present(*element_ids: str) -> Callable[["WebDriver"], bool]:
+    """Readiness check for every one of the elements being on the page"""
+    from selenium.webdriver.common.by import By
+
+    def ready(driver: "WebDriver") -> bool:
+        return all(
+            driver.find_elements(By.ID, element_id)
+            for element_id in element_ids
+        )
+    return ready
+
+
+def logged_in(driver: "WebDriver") -> bool:
+    """Readiness check for the login form being gone, once the page after it
+    has finished loading"""
+    from selenium.webdriver.common.by import By
+
+    if driver.execute_script("return document.readyState") != "complete":
+        return False
+    return not driver.find_elements(By.ID, "uid")
+
+
+def wait_for_schedule(driver: "WebDriver") -> None:
+    """Wait for classes.asp to have its week range and schedule"""
+    wait_until(
+        driver, all_present("weekrange", "scheduleRow"), SCHEDULE,
+        "the class schedule"
+    )
+
+
+def wait_for_login(driver: "WebDriver") -> None:
+    """Wait for the site to take the login form and load the next page"""
+    wait_until(driver, logged_in, LOGIN, "login to complete")
@@ -0,0 +1,373 @@
+"""Watch full classes and book a spot the moment one opens.
+
+Matched classes that are full can only be wait listed. The watcher keeps
+polling the schedule weeks those classes are in, and books a class as soon as
+its `registered / class_size` shows a free spot.
+
+Polls are cheap when nothing changed: a page identical to the last poll of its
+week is skipped outright, and otherwise only the watched classes' own elements
+are hashed, so just the classes that changed are parsed. Each class is polled
+more often the closer it is to starting, between `--min-interval` and
+`--max-interval` seconds, and polls across all weeks are capped at
+`--max-rate` a minute to stay polite to the site.
+
+    python -m clubready_booker.watcher [--dry-run] [--min-interval 5]
+                                       [--max-interval 120] [--max-rate 12]
+"""
+import argparse
+import datetime
+import hashlib
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+import pytz
+
+from clubready_booker import (
+    booker, metrics, setup_logging, snapshots, util, waits, webpage
+)
+from clubready_booker.http_session import ClubReadySession
+from clubready_booker.records import ClassRecord
+
+if TYPE_CHECKING:
+    from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+# seconds between polls of a class about to start, and of one far off
+MIN_INTERVAL = 5.0
+MAX_INTERVAL = 120.0
+# classes starting further off than this are polled at MAX_INTERVAL
+SLOW_HORIZON = datetime.timedelta(hours=12)
+# polls a minute across every watched week
+MAX_RATE = 12.0
+
+
+def poll_interval(
+        class_start: datetime.datetime,
+        now: datetime.datetime,
+        min_interval: float = MIN_INTERVAL,
+        max_interval: float = MAX_INTERVAL,
+        slow_horizon: datetime.timedelta = SLOW_HORIZON
+) -> float:
+    """Seconds until a class should be polled again
+
+    Scales linearly from `min_interval` for a class starting now to
+    `max_interval` for one `slow_horizon` or more away.
+    """
+    fraction = (class_start - now) / slow_horizon
+    fraction = min(max(fraction, 0.0), 1.0)
+    return min_interval + (max_interval - min_interval) * fraction
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` calls a minute, in bursts of up to `burst`
+
+    Args:
+        rate: calls a minute
+        burst: calls that can be made back to back after a quiet spell
+    """
+
+    def __init__(self, rate: float = MAX_RATE, burst: int = 1):
+        self.interval = 60 / rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Wait for a token, returning the seconds waited"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.last) / self.interval
+            )
+            self.last = now
+            wait = 0.0
+            if self.tokens < 1:
+                wait = (1 - self.tokens) * self.interval
+            self.tokens -= 1
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+def class_elements(
+        page: "etree.ElementBase",
+        booking_ids: List[str]
+) -> Dict[str, "etree.ElementBase"]:
+    """Elements of the classes with the booking ids, found by their book
+    button"""
+    wanted = set(booking_ids)
+    found = {}
+    for button in page.iterfind(f".//*[@title='{webpage.BUTTON_TITLE}']"):
+        booking_id = button.get('onclick')
+        if booking_id not in wanted:
+            continue
+        # each class is a div directly under its column's td
+        class_elem = button
+        for ancestor in button.iterancestors():
+            if ancestor.tag == "td":
+                break
+            class_elem = ancestor
+        found[booking_id] = class_elem
+    return found
+
+
+class Watch:
+    """A full class being watched, and what was seen of it last"""
+
+    __slots__ = ('record', 'week', 'fingerprint', 'next_poll')
+
+    def __init__(self, record: ClassRecord, week: datetime.date):
+        self.record = record
+        self.week = week
+        self.fingerprint: Optional[str] = None
+        self.next_poll = time.monotonic()
+
+
+class SpotWatcher:
+    """Polls the weeks of watched classes and books any that open up
+
+    Args:
+        config: from `util.get_config`
+        classes: full classes to watch, each needs a booking id
+        dry_run: go through booking without confirming it
+        min_interval: seconds between polls of a class about to start
+        max_interval: seconds between polls of a class far from starting
+        max_rate: polls a minute, across all weeks
+        open_driver: called for a logged in driver, a `booker.LazyDriver` by
+            default
+    """
+
+    def __init__(
+            self,
+            config: Dict[str, Any],
+            classes: List[ClassRecord],
+            dry_run: bool = False,
+            min_interval: float = MIN_INTERVAL,
+            max_interval: float = MAX_INTERVAL,
+            max_rate: float = MAX_RATE,
+            open_driver: Optional[booker.LazyDriver] = None
+    ):
+        self.config = config
+        self.dry_run = dry_run
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.tz = pytz.timezone(config['timezone'])
+        self.limiter = RateLimiter(max_rate)
+        self.open_driver = open_driver or booker.LazyDriver(config)
+        self.page_hashes: Dict[datetime.date, str] = {}
+        self.watches: Dict[str, Watch] = {}
+        for class_record in classes:
+            if not class_record.booking_id:
+                logger.warning(
+                    f"Can't watch {class_record.class_name} at "
+                    f"{class_record.start_time.isoformat()}, it has no booking "
+                    f"id"
+                )
+                continue
+            week = webpage.week_start(
+                class_record.start_time.astimezone(self.tz).date()
+            )
+            self.watches[class_record.booking_id] = Watch(class_record, week)
+        self.booked: List[Dict[str, Any]] = []
+
+    def now(self) -> datetime.datetime:
+        return datetime.datetime.now(self.tz)
+
+    def next_due(self) -> Tuple[float, datetime.date]:
+        """Monotonic time of the next poll, and the week to poll"""
+        watch = min(self.watches.values(), key=lambda w: w.next_poll)
+        return watch.next_poll, watch.week
+
+    def fetch_week(self, week: datetime.date) -> str:
+        """Page source of a schedule week, logging in again if the session
+        has expired"""
+        for attempt in range(2):
+            driver = self.open_driver()
+            if isinstance(driver, ClubReadySession):
+                source = driver.fetch(webpage.week_url(week, driver.base_url))
+            else:
+                driver.get(
+                    webpage.week_url(week, webpage.driver_base_url(driver))
+                )
+                if webpage.is_logged_in(driver):
+                    waits.wait_for_schedule(driver)
+                source = driver.page_source
+            if 'id="uid"' not in source:
+                return source
+            logger.info("ClubReady session expired, logging in again")
+            self.open_driver.close()
+        raise RuntimeError(f"Could not load the schedule for week of {week}")
+
+    def poll(self, week: datetime.date) -> None:
+        """Fetch a week and book any of its watched classes that opened up"""
+        import lxml.html
+
+        from clubready_booker.fast_parse import ClassParser
+
+        watches = [w for w in self.watches.values() if w.week == week]
+        self.limiter.acquire()
+        with metrics.span("watch_poll"):
+            source = self.fetch_week(week)
+        metrics.count("watch_polls")
+        now = self.now()
+        for watch in watches:
+            watch.next_poll = time.monotonic() + poll_interval(
+                watch.record.start_time, now,
+                self.min_interval, self.max_interval
+            )
+
+        page_hash = hashlib.sha1(source.encode()).hexdigest()
+        if self.page_hashes.get(week) == page_hash:
+            metrics.count("watch_unchanged")
+            return
+        self.page_hashes[week] = page_hash
+
+        page = lxml.html.fromstring(source)
+        elements = class_elements(page, [w.record.booking_id for w in watches])
+        parser = ClassParser(self.config['timezone'], now)
+        opened = []
+        for watch in watches:
+            class_elem = elements.get(watch.record.booking_id)
+            if class_elem is None:
+                logger.debug(
+                    "%s at %s isn't on the page", watch.record.class_name,
+                    watch.record.start_time
+                )
+                continue
+            fingerprint = hashlib.sha1(
+                lxml.html.tostring(class_elem, with_tail=False)
+            ).hexdigest()
+            if fingerprint == watch.fingerprint:
+                continue
+            watch.fingerprint = fingerprint
+            record = parser.parse(
+                class_elem, watch.record.start_time.astimezone(self.tz).date(),
+                0
+            )
+            logger.debug(
+                "%s at %s: %s / %s", record.class_name, record.start_time,
+                record.registered, record.class_size
+            )
+            if record.spots_available:
+                opened.append(record)
+        if opened:
+            metrics.count("spots_opened", len(opened))
+            self.book(opened)
+
+    def book(self, class_records: List[ClassRecord]) -> None:
+        """Book classes from the week page `fetch_week` just loaded"""
+        driver = self.open_driver()
+        results = []
+        for class_record in class_records:
+            logger.info(
+                f"A spot opened in {class_record.class_name} at "
+                f"{class_record.start_time.isoformat()}"
+            )
+            results.append(
+                webpage.attempt_booking(driver, class_record, self.dry_run)
+            )
+        webpage.report_bookings(results)
+        for result in results:
+            if result['status'] == webpage.BOOKED:
+                self.watches.pop(result['booking_id'], None)
+                self.booked.append(result)
+                continue
+            # a lost race to the spot joins the wait list, and a failure may
+            # leave the spot open, so keep watching and look at the class
+            # again on the next poll even if its page hasn't changed
+            watch = self.watches.get(result['booking_id'])
+            if watch is not None:
+                watch.fingerprint = None
+                self.page_hashes.pop(watch.week, None)
+
+    def drop_started(self) -> None:
+        now = self.now()
+        for booking_id, watch in list(self.watches.items()):
+            if watch.record.start_time <= now:
+                logger.info(
+                    f"Stopped watching {watch.record.class_name} at "
+                    f"{watch.record.start_time.isoformat()}, it has started"
+                )
+                del self.watches[booking_id]
+
+    def run(self) -> List[Dict[str, Any]]:
+        """Watch until every class is booked or has started
+
+        Returns:
+            results of the bookings made, see `webpage.book_classes`
+        """
+        logger.info(f"Watching {len(self.watches)} full classes")
+        try:
+            while True:
+                self.drop_started()
+                if not self.watches:
+                    break
+                due, week = self.next_due()
+                time.sleep(max(0.0, due - time.monotonic()))
+                try:
+                    self.poll(week)
+                except Exception:
+                    logger.exception(f"Polling week of {week} failed")
+                    self.open_driver.close()
+                    # try the week again once it is due, not straight away
+                    for watch in self.watches.values():
+                        if watch.week == week:
+                            watch.next_poll = time.monotonic() + \
+                                self.min_interval
+        finally:
+            self.open_driver.close()
+        return self.booked
+
+
+def full_matches(config: Dict[str, Any], open_driver) -> List[ClassRecord]:
+    """Matched classes that are full and haven't started"""
+    matched = booker.find_matches(config, open_driver)
+    return [
+        class_record for class_record in matched
+        if class_record.spots_available is False and not class_record.started
+    ]
+
+
+def main(
+        dry_run: bool = False,
+        min_interval: float = MIN_INTERVAL,
+        max_interval: float = MAX_INTERVAL,
+        max_rate: float = MAX_RATE
+) -> None:
+    config = util.get_config()
+    waits.configure(config['wait_budgets'])
+    open_driver = booker.LazyDriver(config)
+    try:
+        with metrics.recording("watcher", util.to_bool(config['metrics'])):
+            with snapshots.recording(util.to_bool(config['snapshots'])):
+                classes = full_matches(config, open_driver)
+            if not classes:
+                logger.info("No full classes to watch")
+                return
+            SpotWatcher(
+                config, classes, dry_run, min_interval, max_interval,
+                max_rate, open_driver
+            ).run()
+    except KeyboardInterrupt:
+        logger.info("Watcher stopped")
+    except Exception as exc:
+        logger.exception("Encountered an exception")
+        raise exc
+    finally:
+        open_driver.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--min-interval", type=float, default=MIN_INTERVAL)
+    parser.add_argument("--max-interval", type=float, default=MAX_INTERVAL)
+    parser.add_argument("--max-rate", type=float, default=MAX_RATE,
+                        help="polls a minute")
+    args = parser.parse_args()
+    setup_logging()
+    main(args.dry_run, args.min_interval, args.max_interval, args.max_rate)
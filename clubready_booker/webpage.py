@@ -1,46 +1,166 @@
 """Functions for interfacing with the specific ClubReady website."""
-import json
+import hashlib
 import os
 from datetime import date, datetime
 from dateutil.relativedelta import relativedelta
 import pytz
 import time
 import re
+from collections import Counter
 from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
 import logging
 from operator import sub, attrgetter
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple, Callable, TYPE_CHECKING
 from string import punctuation
 
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service as ChromeService
-from selenium.webdriver.common.by import By
-from selenium.webdriver.remote.webdriver import WebDriver
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
-from bs4 import BeautifulSoup
-from bs4.element import Tag
+from selenium.common.exceptions import WebDriverException
 
-from clubready_booker.util import get_config, get_config_location
+from clubready_booker import (
+    metrics, records, session_store, setup_logging, waits
+)
+from clubready_booker.records import ClassRecord
+from clubready_booker.http_session import (
+    BookingRejected, ClubReadySession, check_booking_result, get_session
+)
+from clubready_booker.util import (
+    get_config, get_config_location, default_config_vals
+)
+
+# selenium's webdriver and bs4 take hundreds of ms to import, so they are only
+# imported by the functions that use them
+if TYPE_CHECKING:
+    from bs4.element import Tag
+    from selenium.webdriver.remote.webdriver import WebDriver
+
+    from clubready_booker.table_cache import ClassTableCache
 
 logger = logging.getLogger(__name__)
 
-APP_BASE_URL = "https://app.clubready.com/clients"
+APP_BASE_URL = default_config_vals['base_url']
 WS = re.compile(r"^\s+$")
 DURATION = re.compile(r"(\d+)\s+(hour(s)?|min(s)?)", re.IGNORECASE)
 BUTTON_TITLE = 'Book A Place In This Class'
-TABLE_CACHE_NAME = "class_table_cache.json"
+TABLE_CACHE_NAME = "class_table_cache.msgpack"
+# query parameter classes.asp uses to pick the week shown, MM/DD/YYYY
+WEEK_PARAM = "wkdate"
+BACKENDS = ("selenium", "http")
+BOOKED = "booked"
+WAITLISTED = "waitlisted"
+FAILED = "failed"
+WAITLIST_TEXT = "wait"
+CDP_COOKIE_KEYS = (
+    'name', 'value', 'domain', 'path', 'secure', 'httpOnly', 'sameSite'
+)
+PARSERS = ("fast", "bs4")
+# "lean" runs a headless Chrome that skips what reading the page doesn't need,
+# "default" is Chrome as it comes
+PROFILES = ("lean", "default")
+# requests the lean profile blocks, images are turned off in its preferences
+BLOCKED_URLS = [
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.mp4", "*.webm", "*.mp3", "*.ogg", "*.wav",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*",
+    "*facebook.net*", "*facebook.com/tr*", "*hotjar.com*", "*newrelic.com*",
+    "*nr-data.net*",
+]
+LEAN_ARGS = [
+    "--headless=new",
+    "--disable-gpu",
+    "--disable-extensions",
+    "--disable-dev-shm-usage",
+    "--no-first-run",
+    "--mute-audio",
+    "--window-size=1280,1024",
+]
 
 os.environ['WDM_PROGRESS_BAR'] = "0"
 
 
-def get_driver(url: str) -> WebDriver:
+def chrome_options(profile: str = "lean"):
+    """Chrome options for a browser profile, see `PROFILES`
+
+    The lean profile is headless, doesn't load images, has no GPU or
+    extensions, and returns from `driver.get` once the DOM is ready rather
+    than once every resource has loaded. The waits in `waits` cover anything
+    that comes after.
+    """
+    from selenium import webdriver
+
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown profile {profile}, expected one of {PROFILES}")
+    options = webdriver.ChromeOptions()
+    if profile == "lean":
+        for arg in LEAN_ARGS:
+            options.add_argument(arg)
+        options.add_experimental_option("prefs", {
+            "profile.managed_default_content_settings.images": 2
+        })
+        options.page_load_strategy = "eager"
+    return options
+
+
+def block_resources(
+        driver: "WebDriver",
+        patterns: Optional[List[str]] = None
+) -> None:
+    """Stop the current tab from loading fonts, media and analytics
+
+    Only applies to the tab the driver is on, tabs opened later still load
+    them (but not images, which the lean profile turns off everywhere).
+    """
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd(
+        "Network.setBlockedURLs", {"urls": patterns or BLOCKED_URLS}
+    )
+
+
+@metrics.timed("get_driver")
+def get_driver(
+        url: str,
+        backend: str = "selenium",
+        base_url: str = APP_BASE_URL,
+        profile: str = "lean"
+) -> "WebDriver":
+    """Open the ClubReady login page
+
+    Args:
+        url: login page url
+        backend: "selenium" drives a real Chrome, "http" uses a plain
+            `ClubReadySession` which can be used anywhere a driver is expected
+        base_url: url of the ClubReady clients app, kept on the driver as
+            `base_url` the same way `ClubReadySession` keeps it
+        profile: Chrome profile for the selenium backend, see `PROFILES`
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, expected one of {BACKENDS}")
+    if backend == "http":
+        return get_session(url, base_url)
+    from selenium import webdriver
+    from selenium.common.exceptions import SessionNotCreatedException
+    from selenium.webdriver.chrome.service import Service as ChromeService
+
     try:
-        from webdriver_manager.chrome import ChromeDriverManager
-        exc_path = ChromeDriverManager().install()
-        service = ChromeService(exc_path)
-        driver = webdriver.Chrome(service=service)
+        exc_path = session_store.get_chromedriver_path()
+        try:
+            driver = webdriver.Chrome(
+                service=ChromeService(exc_path), options=chrome_options(profile)
+            )
+        except SessionNotCreatedException:
+            # typically Chrome updated and the cached driver is for the old one
+            new_path = session_store.get_chromedriver_path(refresh=True)
+            if new_path == exc_path:
+                raise
+            logger.warning(
+                f"Could not start Chrome with {exc_path}, retrying with "
+                f"{new_path}"
+            )
+            driver = webdriver.Chrome(
+                service=ChromeService(new_path), options=chrome_options(profile)
+            )
+        driver.base_url = base_url.rstrip("/")
+        if profile == "lean":
+            block_resources(driver)
         driver.get(url)
     except Exception as exc:
         logger.exception("Encountered an error trying to get the page")
@@ -48,32 +168,98 @@ def get_driver(url: str) -> WebDriver:
     return driver
 
 
+@metrics.timed("login")
 def login(
-        driver: WebDriver,
+        driver: "WebDriver",
         username: str,
         password: str
 ) -> None:
-    """Log in to ClubReady account"""
+    """Log in to ClubReady account
+
+    Returns once the site has taken the login and loaded the next page. The
+    driver is left open if logging in fails.
+    """
     logger.info("Logging in")
     try:
+        if isinstance(driver, ClubReadySession):
+            driver.login(username, password)
+            return
+        from selenium.webdriver.common.by import By
+
         uid_form = driver.find_element(by=By.ID, value="uid")
         pw_form = driver.find_element(by=By.ID, value="pw")
         submit = driver.find_element(by=By.CLASS_NAME, value="loginbutt")
         uid_form.send_keys(username)
         pw_form.send_keys(password)
         submit.click()
+        waits.wait_for_login(driver)
     except Exception as exc:
         logger.exception("Encountered an error while logging in")
-        driver.close()
         raise exc
 
 
+def is_logged_in(driver: "WebDriver") -> bool:
+    """Whether the current page is anything but the login form"""
+    return 'id="uid"' not in driver.page_source
+
+
+@metrics.timed("restore_session")
+def restore_session(
+        driver: "WebDriver",
+        cookies: List[Dict[str, Any]],
+        base_url: str = APP_BASE_URL
+) -> bool:
+    """Load saved cookies and check that the site still accepts them
+
+    Leaves the driver on the classes page when it does.
+    """
+    if isinstance(driver, ClubReadySession):
+        driver.add_cookies(cookies)
+        driver.get(driver.classes_url)
+        return is_logged_in(driver)
+    for cookie in cookies:
+        # CDP can set cookies for any domain without navigating there first
+        params = {k: v for k, v in cookie.items() if k in CDP_COOKIE_KEYS}
+        if cookie.get('expiry') is not None:
+            params['expires'] = cookie['expiry']
+        try:
+            driver.execute_cdp_cmd("Network.setCookie", params)
+        except WebDriverException:
+            logger.debug(f"Could not restore cookie {cookie['name']}")
+    driver.get(base_url + "/classes.asp")
+    return is_logged_in(driver)
+
+
+def login_with_saved_session(
+        driver: "WebDriver",
+        username: str,
+        password: str,
+        url: str,
+        base_url: str = APP_BASE_URL
+) -> None:
+    """Reuse the session saved by an earlier run, logging in only if the site
+    rejects it, then save the session for the next run"""
+    cookies = session_store.load_cookies(username, url)
+    if cookies:
+        if restore_session(driver, cookies, base_url):
+            logger.info("Reusing saved ClubReady session")
+            return
+        logger.info("Saved ClubReady session was rejected")
+        if not isinstance(driver, ClubReadySession):
+            driver.get(url)
+    login(driver, username, password)
+    if not isinstance(driver, ClubReadySession):
+        # session cookies are only certain once the logged in page loads
+        get_classes_page(driver)
+    session_store.save_cookies(driver.get_cookies(), username, url)
+
+
 def parse_class_elem(
-        class_elem: Tag,
+        class_elem: "Tag",
         column_date: date,
         class_idx: int,
         timezone: str
-) -> Dict[str, Any]:
+) -> ClassRecord:
     try:
         texts = [
             s.strip() for s in class_elem.strings if WS.match(s) is None
@@ -150,67 +336,140 @@ def parse_class_elem(
             spots_available = (class_size - registered) > 0
         else:
             spots_available = None
-        _class = {
-            "texts": texts,
-            "start_time": class_start,
-            "started": started,
-            "end_time": class_end,
-            "ended": ended,
-            "class_name": class_name,
-            "duration": duration,
-            "instructor": instructor,
-            "registered": registered,
-            "class_size": class_size,
-            "spots_available": spots_available,
-            "booking_id": booking_id
-        }
-        return _class
+        return ClassRecord(
+            start_time=class_start,
+            started=started,
+            end_time=class_end,
+            ended=ended,
+            class_name=class_name,
+            duration=duration,
+            instructor=instructor,
+            registered=registered,
+            class_size=class_size,
+            spots_available=spots_available,
+            booking_id=booking_id,
+            texts=texts if records.keep_texts() else None
+        )
     except Exception as exc:
         logger.exception("Encountered an error during class parsing")
         raise exc
 
 
-def wait_for_elem(driver, attr, val, wait_time=15):
-    try:
-        condition = EC.presence_of_element_located(
-            (By.XPATH, f"//*[@{attr}='{val}']")
-        )
-        WebDriverWait(driver, wait_time).until(condition)
-    except TimeoutException as exc:
-        msg = f"Browser timed out after {wait_time}s"
-        logger.error(msg)
-        driver.close()
-        raise exc
+def wait_for_elem(
+        driver: "WebDriver",
+        attr: str,
+        val: str,
+        wait_time: Optional[float] = None,
+        phase: str = waits.PAGE
+):
+    """Wait for an element with the attribute value to be on the page
+
+    Waits for the phase's budget (see `waits`) unless `wait_time` is given.
+    Raises selenium's TimeoutException if it doesn't show up in time, leaving
+    the driver open.
+    """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+
+    condition = EC.presence_of_element_located(
+        (By.XPATH, f"//*[@{attr}='{val}']")
+    )
+    return waits.wait_until(
+        driver, condition, phase, f"{attr}={val}", wait_time
+    )
+
+
+def driver_base_url(driver: "WebDriver") -> str:
+    """The clients app url the driver was opened for, see `get_driver`"""
+    return getattr(driver, 'base_url', APP_BASE_URL)
+
 
+def get_classes_page(
+        driver: "WebDriver",
+        week: Optional[date] = None,
+        reload: bool = False
+):
+    """Go to classes.asp, or the schedule of `week`, if not already there, or
+    always with `reload`, and wait for the schedule
 
-def get_classes_page(driver: WebDriver):
-    classes_url = APP_BASE_URL + "/classes.asp"
-    if driver.current_url != classes_url:
+    The http backend books from the popup url alone, so it doesn't need the
+    week's page and always stays on classes.asp.
+    """
+    if isinstance(driver, ClubReadySession):
+        driver.get_classes_page()
+        return
+    base_url = driver_base_url(driver)
+    if week is not None:
+        classes_url = week_url(week, base_url)
+    else:
+        classes_url = base_url + "/classes.asp"
+    if reload or driver.current_url != classes_url:
         driver.get(classes_url)
-        wait_for_elem(driver, 'title', BUTTON_TITLE)
+    # also covers a page still loading after login or a redirect
+    waits.wait_for_schedule(driver)
 
 
-def build_class_table(
-        driver: WebDriver,
-        timezone: str
-) -> List[Dict[str, Any]]:
-    """Navigate through the site and build a table of visible classes.
+def week_start(day: date) -> date:
+    """ClubReady schedule weeks start on Sunday"""
+    return day - relativedelta(days=(day.weekday() + 1) % 7)
+
+
+def weeks_in_range(start: date, bookable_range: int) -> List[date]:
+    """Start dates of every schedule week between start and the end of the
+    bookable range, inclusive"""
+    first_week = week_start(start)
+    last_week = week_start(start + relativedelta(days=bookable_range))
+    n_weeks = (last_week - first_week).days // 7 + 1
+    return [first_week + relativedelta(weeks=i) for i in range(n_weeks)]
 
-    Do this part with bs4 since it is just scraping html
+
+def week_url(week: date, base_url: str = APP_BASE_URL) -> str:
+    return f"{base_url}/classes.asp?{WEEK_PARAM}={week:%m/%d/%Y}"
+
+
+def class_week(class_record: ClassRecord) -> Optional[date]:
+    """Start of the schedule week a class is on, the page with its book
+    button"""
+    if class_record.start_time is None:
+        return None
+    return week_start(class_record.start_time.date())
+
+
+def by_week(
+        class_records: List[ClassRecord]
+) -> Dict[Optional[date], List[ClassRecord]]:
+    """Classes grouped by `class_week`, weeks in the order they first come up
+    and classes in their order within each"""
+    weeks: Dict[Optional[date], List[ClassRecord]] = {}
+    for class_record in class_records:
+        weeks.setdefault(class_week(class_record), []).append(class_record)
+    return weeks
+
+
+def column_fingerprint(col_elem: "Tag") -> str:
+    """Hash of a schedule column's html, changes whenever a class in it does"""
+    return hashlib.sha1(str(col_elem).encode()).hexdigest()
+
+
+def parse_class_columns(
+        src: str,
+        timezone: str,
+        cached_columns: Optional[Dict[str, Dict[str, Any]]] = None
+) -> Tuple[List[date], Dict[str, Dict[str, Any]]]:
+    """Parse the page source of classes.asp into its date span and columns
 
     Args:
-        driver: selenium driver, already logged in
-        timezone: timezone for the class times in the class schedule, should be
-            in pytz.all_timezones
+        src: page source of classes.asp
+        timezone: timezone for the class times in the class schedule
+        cached_columns: columns from an earlier parse of the same week. When
+            given, every column is fingerprinted and columns whose fingerprint
+            has not changed are reused instead of parsed again
     Returns:
-        List of dicts, each dict being a class, with information about the class
-        stored in each key: val pair
+        date span of the week, and a dict from each column's iso date to its
+        fingerprint (None if not fingerprinted) and list of classes
     """
-    logger.info("Building class table")
-    time.sleep(1)       # stuff needs to load
-    class_table = []
-    get_classes_page(driver)
-    src = driver.page_source
+    from bs4 import BeautifulSoup, Tag
+
     # source will be the classes for this week, along with all informaiton you
     # need to register
     page = BeautifulSoup(src, features="lxml")
@@ -235,13 +494,181 @@ def build_class_table(
     assert len(all_dates) == len(col_elems), (
         f"Dates and Cols not the same len: {len(all_dates)} != {len(col_elems)}"
     )
+    columns = {}
+    reused = 0
     for column_date, col_elem in zip(all_dates, col_elems):
+        column_key = column_date.isoformat()
+        fingerprint = None
+        if cached_columns is not None:
+            fingerprint = column_fingerprint(col_elem)
+            cached = cached_columns.get(column_key)
+            if cached is not None and cached['fingerprint'] == fingerprint:
+                columns[column_key] = cached
+                reused += 1
+                continue
         class_elems = col_elem.find('td').findChildren("div", recursive=False)
-        for class_idx, class_elem in enumerate(class_elems):
-            class_table.append(
+        columns[column_key] = {
+            'fingerprint': fingerprint,
+            'classes': [
                 parse_class_elem(class_elem, column_date, class_idx, timezone)
+                for class_idx, class_elem in enumerate(class_elems)
+            ]
+        }
+    if cached_columns is not None:
+        logger.debug(
+            "Reused %d of %d unchanged columns for week of %s", reused,
+            len(columns), date_span[0]
+        )
+    return date_span, columns
+
+
+def parse_class_table(
+        src: str,
+        timezone: str
+) -> Tuple[List[date], List[ClassRecord]]:
+    """Parse the page source of classes.asp into its date span and classes"""
+    date_span, columns = parse_class_columns(src, timezone)
+    class_table = [
+        class_record
+        for column in columns.values()
+        for class_record in column['classes']
+    ]
+    return date_span, class_table
+
+
+def get_column_parser(parser: str) -> Callable[..., Tuple[List[date], dict]]:
+    if parser == "bs4":
+        return parse_class_columns
+    if parser == "fast":
+        from clubready_booker import fast_parse
+        return fast_parse.parse_class_columns
+    raise ValueError(f"Unknown parser {parser}, expected one of {PARSERS}")
+
+
+def get_week_sources(driver: "WebDriver", weeks: List[date]) -> List[str]:
+    """Fetch the page source for several schedule weeks at once
+
+    The http backend fetches every week in parallel over its connection pool.
+    With selenium every week is opened in its own tab so the page loads
+    overlap, then each tab is read and closed in turn.
+    """
+    if not weeks:
+        return []
+    if isinstance(driver, ClubReadySession):
+        urls = [week_url(week, driver.base_url) for week in weeks]
+        with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+            return list(executor.map(driver.fetch, urls))
+
+    main_window = driver.current_window_handle
+    known_handles = set(driver.window_handles)
+    tabs = []
+    for week in weeks:
+        driver.execute_script(
+            "window.open(arguments[0]);",
+            week_url(week, driver_base_url(driver))
+        )
+        new_handles = set(driver.window_handles) - known_handles
+        known_handles |= new_handles
+        tabs.extend(new_handles)
+    sources = []
+    try:
+        for tab in tabs:
+            driver.switch_to.window(tab)
+            waits.wait_for_schedule(driver)
+            sources.append(driver.page_source)
+            driver.close()
+    finally:
+        driver.switch_to.window(main_window)
+    return sources
+
+
+def merge_class_tables(
+        class_tables: List[List[ClassRecord]]
+) -> List[ClassRecord]:
+    """Concatenate class tables, dropping classes seen in an earlier table"""
+    merged = []
+    seen = set()
+    for class_table in class_tables:
+        for class_record in class_table:
+            key = class_record.booking_id or (
+                class_record.class_name, class_record.start_time
             )
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append(class_record)
+    return merged
+
+
+@metrics.timed("build_class_table")
+def build_class_table(
+        driver: "WebDriver",
+        timezone: str,
+        bookable_range: Optional[int] = None,
+        cache: Optional["ClassTableCache"] = None,
+        parser: str = "fast"
+) -> List[ClassRecord]:
+    """Navigate through the site and build a table of visible classes.
+
+    Do this part with bs4 since it is just scraping html
 
+    Args:
+        driver: selenium driver, already logged in
+        timezone: timezone for the class times in the class schedule, should be
+            in pytz.all_timezones
+        bookable_range: if given, every week up to this many days from today is
+            fetched, concurrently, instead of just the current week
+        cache: `table_cache.ClassTableCache` to update with the fetched weeks.
+            Columns that have not changed since the cached copy are not parsed
+            again
+        parser: "fast" parses with lxml directly (`fast_parse`), "bs4" with
+            BeautifulSoup. Both give the same table
+    Returns:
+        List of dicts, each dict being a class, with information about the class
+        stored in each key: val pair
+    """
+    logger.info("Building class table")
+    get_classes_page(driver)
+    sources = [driver.page_source]
+    # classes.asp opens on the current week
+    today = datetime.now(pytz.timezone(timezone)).date()
+    weeks = [week_start(today)]
+    if bookable_range is not None:
+        extra_weeks = weeks_in_range(today, bookable_range)[1:]
+        with metrics.span("fetch_weeks"):
+            sources.extend(get_week_sources(driver, extra_weeks))
+        weeks.extend(extra_weeks)
+
+    if cache is not None:
+        cached_columns = [cache.columns(week) for week in weeks]
+    else:
+        cached_columns = [None] * len(weeks)
+    parse_columns = get_column_parser(parser)
+    # a page parses in a couple of ms, less than starting a worker would take
+    with metrics.span("parse"):
+        parsed = [
+            parse_columns(source, timezone, week_columns)
+            for source, week_columns in zip(sources, cached_columns)
+        ]
+    for week, (week_span, _) in zip(weeks, parsed):
+        if week_span[0] != week:
+            logger.warning(
+                f"Asked for the schedule week of {week} but got the week of "
+                f"{week_span[0]}, the site may not start weeks on Sunday or "
+                f"may ignore {WEEK_PARAM}"
+            )
+    if cache is not None:
+        for week_span, columns in parsed:
+            cache.put_week(week_span[0], columns)
+
+    class_table = merge_class_tables([
+        [class_record
+         for column in columns.values()
+         for class_record in column['classes']]
+        for _, columns in parsed
+    ])
+    metrics.count("classes_parsed", len(class_table))
+    date_span = [parsed[0][0][0], parsed[-1][0][-1]]
     date_span_str = " - ".join((d.isoformat() for d in date_span))
     logger.info(
         f"Found {len(class_table)} classes for date range {date_span_str}"
@@ -250,80 +677,225 @@ def build_class_table(
     return class_table
 
 
-def book_class(
-        driver: WebDriver,
-        class_dict: Dict[str, Any],
+def booking_status(button_text: Optional[str]) -> str:
+    """The booking popup's button says whether it books or joins the wait
+    list"""
+    if button_text and WAITLIST_TEXT in button_text.lower():
+        return WAITLISTED
+    return BOOKED
+
+
+@metrics.timed("book_class")
+def book_loaded_class(
+        driver: "WebDriver",
+        class_record: ClassRecord,
         dry_run: bool = False
-) -> None:
-    logger.info(
-        f"Attempting to book {class_dict['class_name']} at "
-        f"{class_dict['start_time'].isoformat()}"
+) -> str:
+    """Book a class from the classes page the driver already has loaded
+
+    Raises:
+        BookingRejected: if the site turns the booking down
+
+    Returns:
+        `BOOKED` or `WAITLISTED`
+    """
+    booking_id = class_record.booking_id
+    if class_record.spots_available == 0:
+        logger.info("No spots available in class, joining the wait list")
+    if isinstance(driver, ClubReadySession):
+        return driver.book(booking_id, dry_run)
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+
+    class_button = (By.XPATH, f"//*[@onclick='{booking_id}']")
+    class_book_button = waits.wait_until(
+        driver, EC.element_to_be_clickable(class_button), waits.POPUP,
+        f"the book button of {class_record.class_name}"
     )
-    try:
-        booking_id = class_dict['booking_id']
-        get_classes_page(driver)
-        class_button = (By.XPATH, f"//*[@onclick='{booking_id}']")
-        class_book_button = driver.find_element(*class_button)
-        driver.execute_script("arguments[0].scrollIntoView(true);", class_book_button)
-        class_book_button.click()
-
-        # The HTML elements for booking a class and adding yourself to the wait
-        # list are pretty much exactly the same, they just have different text
-        if class_dict['spots_available'] == 0:
-            logger.info("No spots available in class, joining the wait list")
-        wait_for_elem(driver, 'id', 'bookbutton')
-        button = (By.ID, "bookbutton")
-        input_tag = (By.TAG_NAME, "input")
-        popup_book_button = driver.find_element(*button)
-        popup_book_button = popup_book_button.find_element(*input_tag)
-        if not dry_run:
-            popup_book_button.click()
-        else:
-            logger.info("Dry Run - would have booked class")
+    driver.execute_script("arguments[0].scrollIntoView(true);", class_book_button)
+    class_book_button.click()
+
+    # The HTML elements for booking a class and adding yourself to the wait
+    # list are pretty much exactly the same, they just have different text
+    wait_for_elem(driver, 'id', 'bookbutton', phase=waits.POPUP)
+    button = (By.ID, "bookbutton")
+    input_tag = (By.TAG_NAME, "input")
+    popup_book_button = driver.find_element(*button)
+    popup_book_button = popup_book_button.find_element(*input_tag)
+    status = booking_status(popup_book_button.get_attribute("value"))
+    if not dry_run:
+        popup_book_button.click()
+        # the popup shows how the booking went in place of its form
+        waits.wait_until(
+            driver, EC.staleness_of(popup_book_button), waits.POPUP,
+            f"the booking of {class_record.class_name} to be answered"
+        )
+        popup = driver.find_elements(By.ID, "MB_window")
+        check_booking_result(popup[0].text if popup else "")
+    else:
+        logger.info("Dry Run - would have booked class")
+
+    # close the popup, and wait for it to be gone rather than a fixed time
+    close_button = driver.find_element(By.ID, "MB_close")
+    close_button.click()
+    waits.wait_until(
+        driver, EC.invisibility_of_element_located(button), waits.POPUP,
+        "the booking popup to close"
+    )
+    return status
 
-        # close the popup
-        close_button = driver.find_element(By.ID, "MB_close")
-        close_button.click()
-        time.sleep(1.5)
 
+def by_scarcity(class_records: List[ClassRecord]) -> List[ClassRecord]:
+    """Classes in the order they are likely to fill, to book those first
+
+    Open classes come first, those with the smallest fraction of spots left
+    first, then full classes, which can only be wait listed, then classes
+    whose size isn't known. Ties keep their order.
+    """
+    def scarcity(class_record: ClassRecord) -> Tuple[int, float]:
+        registered = class_record.registered
+        class_size = class_record.class_size
+        if registered is None or not class_size:
+            return 2, 0.0
+        spots_left = class_size - registered
+        if spots_left <= 0:
+            return 1, 0.0
+        return 0, spots_left / class_size
+    return sorted(class_records, key=scarcity)
+
+
+def attempt_booking(
+        driver: "WebDriver",
+        class_record: ClassRecord,
+        dry_run: bool = False,
+        load_week: bool = False
+) -> Dict[str, Any]:
+    """Book a class from the loaded classes page, recording rather than
+    raising a failure. See `book_classes` for the result
+
+    With `load_week`, the class's schedule week is loaded first if it isn't
+    already.
+    """
+    logger.info(
+        f"Attempting to book {class_record.class_name} at "
+        f"{class_record.start_time.isoformat()}"
+    )
+    error = None
+    started_at = time.time()
+    start = time.perf_counter()
+    try:
+        if load_week:
+            get_classes_page(driver, class_week(class_record))
+        status = book_loaded_class(driver, class_record, dry_run)
+    except BookingRejected as exc:
+        logger.warning(
+            f"ClubReady turned down booking {class_record.class_name} at "
+            f"{class_record.start_time.isoformat()}: {exc}"
+        )
+        status = FAILED
+        error = repr(exc)
     except Exception as exc:
         logger.exception(
-            f"Encountered an Exception while booking {class_dict['class_name']}"
-            f" at {class_dict['start_time'].isoformat()}"
+            f"Encountered an Exception while booking "
+            f"{class_record.class_name} at "
+            f"{class_record.start_time.isoformat()}"
         )
-        raise exc
+        status = FAILED
+        error = repr(exc)
+    return {
+        'class_name': class_record.class_name,
+        'start_time': class_record.start_time,
+        'booking_id': class_record.booking_id,
+        'status': status,
+        'error': error,
+        'dry_run': dry_run,
+        'started_at': started_at,
+        'seconds': time.perf_counter() - start
+    }
+
+
+def report_bookings(results: List[Dict[str, Any]]) -> None:
+    """Count and log booking results, with how long each booking took and
+    when it finished relative to the first attempt"""
+    if not results:
+        return
+    statuses = dict(Counter(result['status'] for result in results))
+    metrics.count("bookings_attempted", len(results))
+    for status, n in statuses.items():
+        metrics.count(f"bookings_{status}", n)
+    first_start = min(result['started_at'] for result in results)
+    for result in results:
+        done_after = result['started_at'] + result['seconds'] - first_start
+        logger.info(
+            f"{result['class_name']} at {result['start_time'].isoformat()}: "
+            f"{result['status']} in {result['seconds'] * 1000:.0f}ms, done "
+            f"{done_after * 1000:.0f}ms after the first attempt"
+        )
+    logger.info(f"Booking results: {statuses}")
 
 
-def serialize_class_table(class_table: List[dict]) -> str:
-    handled = []
-    for row in class_table:
-        for time_key in ['start_time', 'end_time']:
-            date_time: datetime = row[time_key]
-            if date_time is not None:
-                row[time_key] = date_time.isoformat()
-        handled.append(row)
-    return json.dumps(handled)
+def book_classes(
+        driver: "WebDriver",
+        class_records: List[ClassRecord],
+        dry_run: bool = False
+) -> List[Dict[str, Any]]:
+    """Book several classes, loading each schedule week they are on once
 
+    Classes are booked a week at a time, the weeks in the order their first
+    class comes up. A failure to book one class is logged and recorded, and
+    booking moves on to the next class.
+
+    Returns:
+        One result per class, in the order attempted, with the class's name,
+        start time and booking id, its `status` (`BOOKED`, `WAITLISTED` or
+        `FAILED`), the `error` if it failed, `dry_run`, and `started_at`
+        (epoch seconds) and `seconds` for timing
+    """
+    if not class_records:
+        return []
+    results = []
+    for week, week_records in by_week(class_records).items():
+        get_classes_page(driver, week)
+        results.extend(
+            attempt_booking(driver, class_record, dry_run)
+            for class_record in week_records
+        )
+    report_bookings(results)
+    return results
+
+
+def serialize_class_table(class_table: List[ClassRecord]) -> bytes:
+    """Pack a class table, see `records`. The table is not changed"""
+    return records.dumps(class_table)
 
-def load_serialized_class_table(class_table: str) -> List[dict]:
-    class_table = json.loads(class_table)
-    for row in class_table:
-        row['start_time'] = datetime.fromisoformat(row['start_time'])
-        row['end_time'] = datetime.fromisoformat(row['end_time'])
-    return class_table
+
+def load_serialized_class_table(class_table: bytes) -> List[ClassRecord]:
+    return records.loads(class_table)
 
 
 def main(save_cache=False):
+    from clubready_booker.table_cache import ClassTableCache
+
     driver = None
     try:
         config = get_config()
-        driver = get_driver(config['url'])
+        waits.configure(config['wait_budgets'])
+        driver = get_driver(
+            config['url'], config['backend'], config['base_url'],
+            config['browser_profile']
+        )
         login(driver, config['username'], config['password'])
-        class_table = build_class_table(driver, config['timezone'])
+        cache_path = get_config_location().joinpath(TABLE_CACHE_NAME)
+        cache = ClassTableCache.load(cache_path, float(config['cache_ttl']))
+        build_class_table(
+            driver,
+            config['timezone'],
+            int(config['bookable_range']),
+            cache,
+            config['parser']
+        )
         if save_cache:
-            conf_dir = get_config_location()
-            with conf_dir.joinpath(TABLE_CACHE_NAME).open("w") as f:
-                f.write(serialize_class_table(class_table))
+            cache.save()
     except Exception:
         logger.exception("Encountered an exception")
     finally:
@@ -334,4 +906,5 @@ def main(save_cache=False):
 if __name__ == "__main__":
     # Run the webpage and save a cache of the class schedule, so you can do some
     # dev work without hitting the page a bunch
+    setup_logging()
     main(save_cache=False)
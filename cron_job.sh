@@ -7,4 +7,8 @@
 # $ crontab -e
 # and enter this to run the script every night at 00:01
 # 1 0 * * 1-7 cron_job.sh
+#
+# to book the moment classes open instead, run the scheduler as a long running
+# process rather than this cron job:
+# $ python -m clubready_booker.scheduler
 python clubready_booker/booker.py
@@ -4,6 +4,6 @@ from clubready_booker import __version__
 setup(
     name="clubready_booker",
     version=__version__,
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),
     author="Ryan A. Mannion"
 )